@@ -32,8 +32,8 @@ def E(cls, *script, initargs = (), **kwargs):
 unit = E(None, 'z')
 
 def topitch(degree):
-    c = local.context
-    return _topitch(c.get('scale'), c.get('mode'), c.get('tonic'), degree)
+    v = local.frameview
+    return _topitch(v.scale, v.mode, v.tonic, degree)
 
 def _topitch(scale, mode, tonic, degree):
     mode = rebase(mode)
@@ -0,0 +1,207 @@
+# Copyright 2019 Andrzej Cichocki
+
+# This file is part of Lurlene.
+#
+# Lurlene is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Lurlene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Lurlene.  If not, see <http://www.gnu.org/licenses/>.
+
+from .api import D, E, V
+from .bridge import LiveCodingBridge
+from .context import Context, Sections
+from .offline import offlineconfig
+from .parse import EParse, Program, VParse
+from argparse import ArgumentParser
+from functools import reduce
+from itertools import islice
+from pathlib import Path
+from time import perf_counter
+from timeit import Timer
+import json, operator, sys
+
+baselinespath = Path(__file__).with_name('bench.json')
+threshold = 1.5 # Ratio to baseline counted as a regression, generous as timings are noisy.
+microthreshold = 3 # Likewise for results under microtime, which are noisier still.
+microtime = 1e-5
+
+class Note:
+
+    def on(self, frame, chip, pitch):
+        chip.pitch = pitch[frame]
+        chip.level = 15 - frame.pick([0, 1, 2, 3]) if frame < 4 else 11
+
+class Proxy:
+
+    def blank(self):
+        self.__dict__.clear()
+
+def _songtext(n):
+    lines = ['from lurlene import D, E, V', 'from lurlene.bench import Note']
+    for i in range(n):
+        lines.append(f"p{i} = V('{i % 12} 2x{i % 5} 3/4 2 1 0')")
+        lines.append(f"e{i} = E(Note, '2 1 1r1 4x1', pitch = p{i} + V('12x/ 0'))")
+    lines.append('speed = 8')
+    lines.append(f"sections = [{', '.join(f'(e{i}, e{(i + 1) % n})' for i in range(n))}]")
+    return '\n'.join(lines)
+
+class Benchmarks:
+    'Each bench method does its setup and returns the callable to time, results are checked against bench.json baselines. If the callable has a setup attribute, that is called untimed before each call.'
+
+    def bench_vparse(self):
+        text = ' '.join(f"{i % 7}x{i % 13}/{i % 3 + 1}" if i % 4 else str(i % 11) for i in range(2000))
+        parser = VParse(float, 0, False)
+        return lambda: parser._parse(text, None) # Bypass the cache.
+
+    def bench_eparse(self):
+        text = ' '.join(('2x1', '3r1', '1', '.5r', '4', '2z')[i % 6] for i in range(2000))
+        parser = EParse(Program(Note, ()), object())
+        return lambda: parser._parse(text, None)
+
+    def bench_reparse(self):
+        text = ' '.join(f"{i % 7}x{i % 13}/{i % 3 + 1}" if i % 4 else str(i % 11) for i in range(2000))
+        etext = ' '.join(('2x1', '3r1', '1', '.5r', '4', '2z')[i % 6] for i in range(2000))
+        return lambda: (V(text), E(Note, etext))
+
+    def bench_vindex(self):
+        v = V('0 2x1 3/4 2 1 0x5 7/2')
+        return lambda: [v[frame] for frame in range(1000)]
+
+    def bench_dindex(self):
+        d = D('1 3 5 + 2+ - 2- ++ 3#+ 4bb-')
+        return lambda: [d[frame] for frame in range(1000)]
+
+    def bench_eindex(self):
+        e = E(Note, '2 1 1r1 4x1 3r.5', pitch = V('1 2 3'))
+        return lambda: [e[frame] for frame in range(1000)]
+
+    def bench_deeptree(self):
+        v = reduce(operator.add, ((V(f"{i} {i + 1}x2") >> i) | V('5/2 0') for i in range(20)))
+        return lambda: [v[frame] for frame in range(100)]
+
+    def _update(self, lazy):
+        text = _songtext(100)
+        def update():
+            c = Context(offlineconfig(440, lazy = lazy), ())
+            c.update(text)
+        return update
+
+    def bench_resend(self):
+        c = Context(offlineconfig(440), ())
+        text = _songtext(100)
+        c.update(text)
+        return lambda: c.update(text)
+
+    def bench_updatejustexec(self):
+        return self._update(False)
+
+    def bench_updatelazy(self):
+        return self._update(True)
+
+    def bench_flip(self):
+        c = Context(offlineconfig(440), ())
+        c.update(_songtext(10))
+        c.flip()
+        def flip():
+            c.flip()
+        def setup():
+            c.update('x = object()') # So that the flip has a change to publish.
+        flip.setup = setup
+        return flip
+
+    def bench_adjustframeindex(self):
+        class Fake:
+            def __init__(self, sections):
+                self.g = dict(speed = 8, sections = sections)
+                self.sections = Sections(8, sections)
+            def get(self, name):
+                return self.g[name]
+        patterns = [(V('1'),) for _ in range(200)]
+        for i, p in enumerate(patterns):
+            p[0].len = i + 1
+        old = Sections(8, patterns)
+        bridge = LiveCodingBridge(offlineconfig(440), Fake(patterns[:100] + [(V('1'),)] + patterns[100:]))
+        frames = [old.startframe(i) + .5 for i in range(0, 200, 7)]
+        new = bridge.context.sections
+        return lambda: [bridge._adjustframeindex(old, new, f) for f in frames]
+
+    def bench_frames(self):
+        config = offlineconfig(440)
+        c = Context(config, ())
+        c.update(_songtext(4))
+        c.flip()
+        frames = LiveCodingBridge(config, c).frames(dict(chip = [Proxy(), Proxy()]))
+        return lambda: list(islice(frames, 100))
+
+def _reference():
+    'Fixed workload timed in the same run as the benchmarks, so that baselines do not depend on the speed of the machine.'
+    d = {}
+    for i in range(10000):
+        d[str(i)] = d.get(str(i % 97), 0) + i
+    return sorted(d.items())
+
+def measure(f, mintime = .2, repeat = 5):
+    'Best seconds per call.'
+    setup = getattr(f, 'setup', None)
+    if setup is not None:
+        return min(_measuresetup(f, setup, mintime) for _ in range(repeat))
+    timer = Timer(f)
+    number, _ = timer.autorange()
+    number = max(1, int(number * mintime / .2))
+    return min(timer.repeat(repeat, number)) / number
+
+def _measuresetup(f, setup, mintime):
+    total = n = 0
+    end = perf_counter() + mintime
+    while not n or perf_counter() < end:
+        setup()
+        start = perf_counter()
+        f()
+        total += perf_counter() - start
+        n += 1
+    return total / n
+
+def run(names = None):
+    'Seconds per call of each benchmark, and of the reference workload as the best of before and after them.'
+    b = Benchmarks()
+    reference = measure(_reference)
+    results = {}
+    for attr in sorted(dir(b)):
+        if attr.startswith('bench_'):
+            name = attr[len('bench_'):]
+            if names is None or name in names:
+                results[name] = measure(getattr(b, attr)())
+    return results, min(reference, measure(_reference))
+
+def main_lurlene_bench():
+    parser = ArgumentParser()
+    parser.add_argument('--save', action = 'store_true', help = 'record results as the new baselines')
+    parser.add_argument('--threshold', type = float, default = threshold)
+    parser.add_argument('name', nargs = '*')
+    args = parser.parse_args()
+    baselines = json.loads(baselinespath.read_text()) if baselinespath.exists() else {}
+    results, reference = run(args.name or None)
+    relative = {name: t / reference for name, t in results.items()} # Baselines are in units of the reference workload.
+    regressions = []
+    for name, t in results.items():
+        base = baselines.get(name)
+        ratio = None if base is None else relative[name] / base
+        print(f"{name}\t{t * 1e6:.1f}us\t{'' if ratio is None else f'{ratio:.2f}x'}")
+        if ratio is not None and ratio > (args.threshold if t >= microtime else max(args.threshold, microthreshold)):
+            regressions.append(name)
+    if args.save:
+        baselinespath.write_text(json.dumps({**baselines, **relative}, indent = 2, sort_keys = True) + '\n')
+    if regressions:
+        print('Regressed:', *regressions, file = sys.stderr)
+        sys.exit(1)
+
+if '__main__' == __name__:
+    main_lurlene_bench()
@@ -15,13 +15,16 @@
 # You should have received a copy of the GNU General Public License
 # along with Lurlene.  If not, see <http://www.gnu.org/licenses/>.
 
-from .context import Sections, Context
+from .context import Context, FrameView, Sections
+from .latency import Histogram, now, Timings
+from .model import tabulation
 from .util import catch, Config, threadlocals
 from diapyr import types
-from diapyr.util import innerclass, singleton
+from diapyr.util import innerclass
 from functools import partial
 from itertools import zip_longest
-import logging, bisect, difflib
+from splut.bg import SimpleBackground
+import bisect, logging
 
 log = logging.getLogger(__name__)
 
@@ -33,6 +36,63 @@ class Channel:
         self.letter = chr(ord('A') + index)
         self.nametoproxy = nametoproxy
 
+class SectionCursor:
+    'Find the section and local frame of each frame index, stepping from the last one instead of searching when possible.'
+
+    def __init__(self):
+        self.sections = None
+
+    def sectionandframe(self, sections, frameindex):
+        sections.refresh()
+        if sections is not self.sections or sections.version != self.version:
+            self._seek(sections, frameindex)
+        elif not self.start <= frameindex < self.end:
+            i = (self.index + 1) % len(sections.lengths)
+            while not sections.lengths[i]: # Terminates as we never seek to an empty song.
+                i = (i + 1) % len(sections.lengths)
+            if self.end <= frameindex < self.end + sections.lengths[i]:
+                self.index = i
+                self.start, self.end = self.end, self.end + sections.lengths[i]
+            else:
+                self._seek(sections, frameindex)
+        return sections.sections[self.index], frameindex - self.start
+
+    def _seek(self, sections, frameindex):
+        self.sections = sections
+        self.version = sections.version
+        ends = sections.ends
+        total = ends[-1]
+        base = frameindex // total * total
+        self.index = i = bisect.bisect(ends, frameindex - base)
+        self.start = base + (ends[i - 1] if i else 0)
+        self.end = base + ends[i]
+
+class Tabulator(SimpleBackground):
+    'Build the tables requested by the frame loop, so that it does not have to.'
+
+    daemon = True
+
+    def start(self):
+        super().start(self.bg, self)
+
+    def interrupt(self):
+        with tabulation.cond:
+            tabulation.cond.notify_all()
+
+    def bg(self, _):
+        while True:
+            with tabulation.cond:
+                while not self.quit and not tabulation.requested:
+                    tabulation.cond.wait()
+            if self.quit:
+                break
+            tabulation.build()
+
+class NullProxy:
+
+    def blank(self):
+        self.__dict__.clear()
+
 class LiveCodingBridge:
 
     bias = .5 # TODO: Make configurable for predictable swing in odd speed case.
@@ -42,6 +102,9 @@ class LiveCodingBridge:
         self.loop = not config.ignoreloop
         self.sectionname = config.section
         self.context = context
+        self.timings = Timings(getattr(config.Lurlene, 'deadline', None)) # Deadline in seconds for prepare plus perform, or None.
+        self.prewarm = getattr(config.Lurlene, 'prewarm', 0) # Number of frames to dry-run on update before flip, from where we are.
+        self.upcoming = 0
 
     @property
     def pianorollheight(self):
@@ -53,6 +116,8 @@ class LiveCodingBridge:
         def __init__(self, chips):
             self.channels = [Channel(index, {name: proxy for name, proxy in zip(chips, proxies) if proxy is not None})
                     for index, proxies in enumerate(zip_longest(*chips.values()))]
+            for channel in self.channels:
+                channel.latency = self.timings.channel(channel.letter)
 
         def _quiet(self):
             for channel in self.channels:
@@ -62,57 +127,146 @@ class LiveCodingBridge:
         def _step(self, speed, section, frame):
             self._quiet()
             for channel, pattern in zip(self.channels, section):
+                start = now()
                 with catch(channel, "Channel %s update failed:", channel.letter):
                     pattern.apply(speed, frame, channel.nametoproxy)
+                channel.latency.record(now() - start)
 
     def _initialframe(self):
         if self.sectionname is None:
             sectionindex = 0
         else:
-            section = getattr(self.context, self.sectionname)
+            section = self.context.get(self.sectionname)
             try:
                 sectionindex = self.context.get('sections').index(section)
             except ValueError:
                 raise NoSuchSectionException(self.sectionname)
         return self.context.sections.startframe(sectionindex)
 
-    def frames(self, chips):
+    def frames(self, chips, startframe = None):
         session = self.Session(chips)
-        frameindex = self._initialframe() + self.bias
-        with threadlocals(context = self.context):
-            while self.loop or frameindex < self.context.sections.totalframecount:
-                oldspeed = self.context.get('speed')
-                oldsections = self.context.get('sections')
-                frame = session._quiet
-                if self.context.sections.totalframecount: # Otherwise freeze until there is something to play.
-                    with catch(session, 'Failed to prepare a frame:'):
-                        frame = partial(session._step, self.context.get('speed'), *self.context.sections.sectionandframe(frameindex))
-                        frameindex += 1
-                frame()
-                yield
-                self.context.flip()
-                if oldspeed != self.context.get('speed'):
-                    frameindex = (frameindex - self.bias) / oldspeed * self.context.get('speed') + self.bias
-                if oldsections != self.context.get('sections'):
-                    frameindex = self._adjustframeindex(Sections(self.context.get('speed'), oldsections), frameindex)
-
-    def _adjustframeindex(self, oldsections, frameindex):
-        baseframe = (frameindex // oldsections.totalframecount) * self.context.sections.totalframecount
+        frameindex = (self._initialframe() if startframe is None else startframe) + self.bias
+        cursor = SectionCursor()
+        tabulator = Tabulator()
+        tabulator.start()
+        if self.prewarm:
+            self.context.prewarm = partial(self._prewarm, {name: len(proxies) for name, proxies in chips.items()})
+        try:
+            with threadlocals(context = self.context):
+                view = FrameView(self.context)
+                while True:
+                    totalframecount = view.sections.totalframecount
+                    if not (self.loop or frameindex < totalframecount):
+                        break
+                    start = now()
+                    frame = session._quiet
+                    if totalframecount: # Otherwise freeze until there is something to play.
+                        with catch(session, 'Failed to prepare a frame:'):
+                            frame = partial(session._step, view.speed, *cursor.sectionandframe(view.sections, frameindex))
+                            frameindex += 1
+                            self.upcoming = frameindex
+                    self.timings.prepare.record(now() - start)
+                    with threadlocals(frameview = view):
+                        frame()
+                    self.timings.framedone(now() - start)
+                    yield
+                    start = now()
+                    self.context.flip()
+                    self.timings.flip.record(now() - start)
+                    oldview, view = view, FrameView(self.context)
+                    frameindex = self._follow(oldview, view, frameindex)
+        finally:
+            tabulator.stop()
+            if self.prewarm:
+                self.context.prewarm = None
+
+    def _prewarm(self, chipcounts, view):
+        session = self.Session({name: [NullProxy() for _ in range(n)] for name, n in chipcounts.items()})
+        for channel in session.channels:
+            channel.latency = Histogram() # Keep out of our timings.
+        cursor = SectionCursor()
+        frameindex = self._follow(FrameView(self.context), view, self.upcoming) # Where frames will be after the flip.
+        with threadlocals(frameview = view):
+            for i in range(self.prewarm):
+                session._step(view.speed, *cursor.sectionandframe(view.sections, frameindex + i))
+
+    def _follow(self, oldview, view, frameindex):
+        'Return the frame index in the new view that corresponds to the given one in the old view.'
+        if oldview.speed != view.speed:
+            frameindex = (frameindex - self.bias) / oldview.speed * view.speed + self.bias
+        if oldview.sections.sections != view.sections.sections:
+            frameindex = self._adjustframeindex(Sections(view.speed, oldview.sections.sections), view.sections, frameindex)
+        return frameindex
+
+    def _adjustframeindex(self, oldsections, newsections, frameindex):
+        baseframe = (frameindex // oldsections.totalframecount) * newsections.totalframecount
         localframe = frameindex % oldsections.totalframecount
         oldsectionindex = bisect.bisect(oldsections.sectionends, localframe)
         sectionframe = localframe - oldsections.startframe(oldsectionindex)
-        opcodes = difflib.SequenceMatcher(a = oldsections.sections, b = self.context.get('sections')).get_opcodes()
-        @singleton
-        def sectionindexandframe():
-            for tag, i1, i2, j1, j2 in opcodes:
-                if 'equal' == tag and i1 <= oldsectionindex and oldsectionindex < i2:
-                    return j1 + oldsectionindex - i1, sectionframe
-            oldsection = oldsections.sections[oldsectionindex]
-            for tag, i1, i2, j1, j2 in opcodes:
-                if 'insert' == tag and oldsection in self.context.get('sections')[j1:j2]:
-                    return j1 + self.context.get('sections')[j1:j2].index(oldsection), sectionframe
-            for tag, i1, i2, j1, j2 in opcodes:
-                if tag in {'delete', 'replace'} and i1 <= oldsectionindex and oldsectionindex < i2:
-                    return j1, self.bias
-            return 0, self.bias # TODO: Test this case
-        return baseframe + self.context.sections.startframe(sectionindexandframe[0]) + sectionindexandframe[1]
+        sectionindex, kept = _remap(oldsections.sections, newsections.sections, oldsectionindex)
+        return baseframe + newsections.startframe(sectionindex) + (sectionframe if kept else self.bias)
+
+def _remap(old, new, i):
+    'Index in new of the section at index i in old and True, or where it would have been and False if it was removed.'
+    # Sections are compared by the identities of their patterns, like tuple equality does:
+    oldkeys = [tuple(map(id, section)) for section in old]
+    newkeys = [tuple(map(id, section)) for section in new]
+    n = min(len(oldkeys), len(newkeys))
+    prefix = 0
+    while prefix < n and oldkeys[prefix] == newkeys[prefix]:
+        prefix += 1
+    if i < prefix:
+        return i, True
+    suffix = 0
+    while suffix < n - prefix and oldkeys[-1 - suffix] == newkeys[-1 - suffix]:
+        suffix += 1
+    if i >= len(oldkeys) - suffix:
+        return i - len(oldkeys) + len(newkeys), True
+    matches = _match(oldkeys[prefix:len(oldkeys) - suffix], newkeys[prefix:len(newkeys) - suffix])
+    k = i - prefix
+    if matches[k] is not None:
+        return prefix + matches[k], True
+    # Otherwise just after whatever it followed that was kept:
+    while k and matches[k - 1] is None:
+        k -= 1
+    return prefix + (matches[k - 1] + 1 if k else 0), False
+
+def _match(a, b):
+    'For each index in a the index in b of the same key, or None, in linear time.'
+    positions = {}
+    for j, key in enumerate(b):
+        positions.setdefault(key, []).append(j)
+    counts = {}
+    for key in a:
+        counts[key] = counts.get(key, 0) + 1
+    matches = [None] * len(a)
+    taken = [False] * len(b)
+    def pair(x, y):
+        matches[x] = y
+        taken[y] = True
+    # Keys that occur once on each side are unambiguous:
+    for x, key in enumerate(a):
+        js = positions.get(key, ())
+        if 1 == counts[key] and 1 == len(js):
+            pair(x, js[0])
+    # Extend those to runs of equal neighbours:
+    for x in range(len(a) - 1):
+        y = matches[x]
+        if y is not None and matches[x + 1] is None and y + 1 < len(b) and not taken[y + 1] and a[x + 1] == b[y + 1]:
+            pair(x + 1, y + 1)
+    for x in range(len(a) - 1, 0, -1):
+        y = matches[x]
+        if y is not None and matches[x - 1] is None and y and not taken[y - 1] and a[x - 1] == b[y - 1]:
+            pair(x - 1, y - 1)
+    # Pair up the rest by occurrence:
+    cursors = {}
+    for x, key in enumerate(a):
+        if matches[x] is None:
+            js = positions.get(key, ())
+            c = cursors.get(key, 0)
+            while c < len(js) and taken[js[c]]:
+                c += 1
+            if c < len(js):
+                pair(x, js[c])
+            cursors[key] = c
+    return matches
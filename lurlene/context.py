@@ -16,56 +16,74 @@
 # along with Lurlene.  If not, see <http://www.gnu.org/licenses/>.
 
 from .api import E
+from .model import lazies
 from .transform import Interpreter
-from .util import Config, Lazy
+from .util import catch, Config, Lazy, lazyversion
 from .xtra import XTRA
 from diapyr import types
+from itertools import accumulate
 import bisect, logging, threading
 
 log = logging.getLogger(__name__)
 
+class View:
+    'References that readers must see together, so they are only ever replaced as a whole.'
+
+    def __init__(self, globals, updates, snapshot):
+        self.globals = globals
+        self.updates = updates
+        self.snapshot = snapshot # Value at last flip of each name updated since.
+
 class Context:
 
     lazyname = '_lazy' # XXX: More reliably avoid collision?
     deleted = object()
+    absent = object()
 
     @types(Config)
     def __init__(self, config, sections = [(E(XTRA, '11r1'),)]):
-        self.fastglobals = self.slowglobals = dict(
+        self.slowglobals = dict(
             {self.lazyname: Lazy},
             tuning = config.tuning,
             mode = 1,
             speed = 16, # XXX: Needed when sections is empty?
             sections = sections,
         )
-        self.snapshot = self.fastglobals.copy()
-        self.fastupdates = self.slowupdates = {}
+        self.slowupdates = {}
+        self.view = View(self.slowglobals, self.slowupdates, {})
+        self.generation = 0 # Bumped by any flip that publishes changes.
+        self.prewarm = None # Function of a FrameView of pending globals, to dry-run them before flip.
         self.cache = {}
         self.slowlock = threading.Lock()
-        self.fastlock = threading.Lock()
         i = Interpreter(self.lazyname, self.slowglobals)
-        self.interpret = i.interpret if config.Lurlene.lazy else i.justexec
+        self.interpret = i.interpret if config.Lurlene.lazy else i.execute
 
     def update(self, text):
         addupdate = []
         delete = []
+        snapshot = {}
         with self.slowlock:
-            with self.fastlock:
-                self.fastglobals = self.slowglobals.copy()
-                self.fastupdates = self.slowupdates.copy()
             before = self.slowglobals.copy()
-            self.interpret(text) # XXX: Impact of modifying mutable objects?
+            self.view = View(before, self.slowupdates, self.view.snapshot)
+            updates = self.slowupdates.copy() # Published dicts are never modified.
+            with lazyversion.updating():
+                self.interpret(text) # XXX: Impact of modifying mutable objects?
+            def changed(name, value):
+                if name not in updates:
+                    snapshot[name] = before.get(name, self.deleted)
+                updates[name] = value
             for name, value in self.slowglobals.items():
                 if not (name in before and value is before[name]):
-                    self.slowupdates[name] = value
+                    changed(name, value)
                     addupdate.append(name)
             for name in before:
                 if name not in self.slowglobals:
-                    self.slowupdates[name] = self.deleted
+                    changed(name, self.deleted)
                     delete.append(name)
-            with self.fastlock:
-                self.fastglobals = self.slowglobals
-                self.fastupdates = self.slowupdates
+            self.slowupdates = updates
+            self.view = View(self.slowglobals, updates, {**self.view.snapshot, **snapshot})
+            if self.prewarm is not None and (addupdate or delete):
+                self._prewarm(self.prewarm, Pending(self.slowglobals.copy())) # Under the lock so that flip can't publish the changes until it's done.
         if addupdate:
             log.info("Add/update: %s", ', '.join(addupdate))
         if delete:
@@ -73,12 +91,23 @@ class Context:
         if not (addupdate or delete):
             log.info('No change.')
 
+    def _prewarm(self, prewarm, pending):
+        try:
+            args = [pending.get('speed'), pending.get('sections')]
+            pending.sections = Sections(*args)
+            if pending.sections.lengths: # Otherwise nothing will play.
+                self.cache['sections'] = [(args, pending.sections), *self.cache.get('sections', [])[:1]]
+                prewarm(FrameView(pending))
+        except Exception:
+            log.exception('Pre-warm failed:')
+
     def flip(self):
         if self.slowlock.acquire(False):
             try:
-                with self.fastlock:
-                    self.snapshot = self.fastglobals.copy()
-                    self.fastupdates.clear()
+                if self.slowupdates:
+                    self.generation += 1
+                self.slowupdates = {}
+                self.view = View(self.view.globals, self.slowupdates, {}) # Not slowglobals, which may have been partially updated by a failed update.
             finally:
                 self.slowlock.release()
 
@@ -86,17 +115,14 @@ class Context:
 
     def get(self, name):
         'Include changes made via global keyword.'
-        with self.fastlock:
-            # If the fastglobals value (or deleted) is due to update, return snapshot value (or deleted):
-            value = self.fastglobals.get(name, self.deleted)
-            if name in self.fastupdates and value is self.fastupdates[name]:
-                try:
-                    return self.snapshot[name]
-                except KeyError:
-                    raise self.NoSuchGlobalException(name) # TODO: Test this case.
-            if value is self.deleted:
-                raise self.NoSuchGlobalException(name)
-            return value
+        view = self.view # Never locks, the view is replaced rather than modified.
+        # If the globals value (or deleted) is due to update, return snapshot value (or deleted):
+        value = view.globals.get(name, self.deleted)
+        if value is view.updates.get(name, self.absent):
+            value = view.snapshot[name]
+        if value is self.deleted:
+            raise self.NoSuchGlobalException(name)
+        return value
 
     def _cachedproperty(f):
         name = f.__name__
@@ -104,14 +130,12 @@ class Context:
         params = code.co_varnames[1:code.co_argcount]
         def fget(self):
             args = [self.get(p) for p in params]
-            try:
-                cacheargs, value = self.cache[name]
+            entries = self.cache.get(name, [])
+            for cacheargs, value in entries:
                 if all(x is y for x, y in zip(cacheargs, args)):
                     return value
-            except KeyError:
-                pass
             value = f(*[self] + args)
-            self.cache[name] = args, value
+            self.cache[name] = [(args, value), *entries[:1]] # Also keep the previous, which may be a pre-warmed one.
             return value
         return property(fget)
 
@@ -119,17 +143,78 @@ class Context:
     def sections(self, speed, sections):
         return Sections(speed, sections)
 
+class Pending:
+    'Globals as they will be after the next flip.'
+
+    def __init__(self, globals):
+        self.globals = globals
+
+    def get(self, name):
+        try:
+            return self.globals[name]
+        except KeyError:
+            raise Context.NoSuchGlobalException(name)
+
+class FrameView:
+    'Globals needed by a frame, resolved together once per frame.'
+
+    names = 'speed', 'scale', 'mode', 'tonic', 'tuning'
+
+    def __init__(self, context):
+        for name in self.names:
+            try:
+                setattr(self, name, context.get(name))
+            except Context.NoSuchGlobalException:
+                pass
+        self.sections = context.sections
+
+    def __getattr__(self, name):
+        if name in self.names:
+            raise Context.NoSuchGlobalException(name)
+        raise AttributeError(name)
+
 class Sections:
+    'Section end frames, the affected tail is recalculated when a lazy section or pattern is resized.'
 
     def __init__(self, speed, sections):
-        def sectionends():
-            end = 0
-            for section in sections:
-                end += speed * max(pattern.len for pattern in section)
-                yield end
-        # FIXME: Recalculate sectionends when a lazy section is resized.
-        self.sectionends = list(sectionends())
+        self.speed = speed
         self.sections = sections
+        self.lazies = {} # Keyed by id, value is the lazy, what it last resolved to, and the indices of sections it is part of.
+        self.lengths = [self._length(i) for i in range(len(sections))]
+        self.ends = list(accumulate(self.lengths))
+        self.updates = lazyversion.updates
+        self.version = 0 # Bumped when any length changes.
+
+    def _length(self, i):
+        section = self.sections[i]
+        length = self.speed * max(pattern.len for pattern in section)
+        for lazy, target in lazies(section):
+            self.lazies.setdefault(id(lazy), [lazy, target, set()])[2].add(i)
+        return length
+
+    def _resize(self, indices):
+        for i in indices:
+            with catch(self, 'Failed to resize section, keeping its length:'):
+                self.lengths[i] = self._length(i)
+        start = min(indices)
+        self.ends[start:] = list(accumulate(self.lengths[start:], initial = self.ends[start - 1] if start else 0))[1:] # One assignment for the benefit of concurrent readers.
+        self.version += 1 # After, so a reader that sees it also sees the new ends.
+
+    def refresh(self):
+        # Only an update can rebind what a lazy resolves to (short of the global keyword), so look after each one:
+        if self.updates != lazyversion.updates:
+            self.updates = lazyversion.updates
+            for entry in list(self.lazies.values()):
+                with catch(self, 'Failed to resolve section or pattern, keeping its length:'):
+                    target = entry[0]._resolve()
+                    if target is not entry[1]:
+                        entry[1] = target
+                        self._resize(entry[2])
+
+    @property
+    def sectionends(self):
+        self.refresh()
+        return self.ends
 
     @property
     def totalframecount(self):
@@ -139,6 +224,7 @@ class Sections:
         return self.sectionends[sectionindex - 1] if sectionindex else 0
 
     def sectionandframe(self, frameindex):
-        localframe = frameindex % self.sectionends[-1]
-        i = bisect.bisect(self.sectionends, localframe)
-        return self.sections[i], localframe - self.startframe(i)
+        sectionends = self.sectionends
+        localframe = frameindex % sectionends[-1]
+        i = bisect.bisect(sectionends, localframe)
+        return self.sections[i], localframe - (sectionends[i - 1] if i else 0)
@@ -0,0 +1,105 @@
+# Copyright 2019 Andrzej Cichocki
+
+# This file is part of Lurlene.
+#
+# Lurlene is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Lurlene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Lurlene.  If not, see <http://www.gnu.org/licenses/>.
+
+from time import perf_counter_ns
+
+now = perf_counter_ns
+
+class Histogram:
+    'Log-linear buckets of nanosecond durations in the style of HdrHistogram, with relative error under 2 ** (1 - precision).'
+
+    def __init__(self, precision = 7):
+        self.precision = precision
+        self.half = 1 << (precision - 1)
+        self.reset()
+
+    def reset(self):
+        self.counts = []
+        self.count = 0
+        self.max = 0
+
+    def _index(self, value):
+        e = value.bit_length() - self.precision
+        return value if e <= 0 else e * self.half + (value >> e)
+
+    def _highest(self, index):
+        if index < 2 * self.half:
+            return index
+        e = index // self.half - 1
+        return ((index - e * self.half + 1) << e) - 1
+
+    def record(self, value):
+        i = self._index(value)
+        if i >= len(self.counts):
+            self.counts.extend([0] * (i + 1 - len(self.counts)))
+        self.counts[i] += 1
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        'Highest value equivalent to the one at the given percentile, or None if nothing recorded.'
+        if not self.count:
+            return
+        target = max(1, p * self.count / 100)
+        total = 0
+        for i, n in enumerate(self.counts):
+            total += n
+            if total >= target:
+                return min(self._highest(i), self.max)
+
+    def above(self, value):
+        'Number of values in buckets wholly above the given value.'
+        return sum(self.counts[self._index(value) + 1:])
+
+class Timings:
+    'Latency histograms of each part of the frame loop, and how many frames blew the deadline.'
+
+    percentiles = 50, 90, 99, 99.9
+
+    def __init__(self, deadline = None):
+        self.deadline = None if deadline is None else int(deadline * 1e9)
+        self.prepare = Histogram()
+        self.frame = Histogram()
+        self.flip = Histogram()
+        self.channels = {}
+        self.misses = 0
+
+    def reset(self):
+        'Clear in place, as sessions hold on to their channel histograms.'
+        for h in [self.prepare, self.frame, self.flip, *self.channels.values()]:
+            h.reset()
+        self.misses = 0
+
+    def channel(self, letter):
+        try:
+            return self.channels[letter]
+        except KeyError:
+            self.channels[letter] = h = Histogram()
+            return h
+
+    def framedone(self, elapsed):
+        self.frame.record(elapsed)
+        if self.deadline is not None and elapsed > self.deadline:
+            self.misses += 1
+
+    def summary(self):
+        'Percentiles and max in seconds keyed by part, channels are keyed by letter.'
+        def stats(h):
+            return dict(count = h.count, max = h.max / 1e9, **{"p%s" % p: None if h.count == 0 else h.percentile(p) / 1e9 for p in self.percentiles})
+        return dict(prepare = stats(self.prepare), frame = stats(self.frame), flip = stats(self.flip),
+                channels = {letter: stats(h) for letter, h in sorted(self.channels.items())}, misses = self.misses)
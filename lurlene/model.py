@@ -15,45 +15,108 @@
 # You should have received a copy of the GNU General Public License
 # along with Lurlene.  If not, see <http://www.gnu.org/licenses/>.
 
-from math import floor
-import bisect, numpy as np
+from .util import Lazy, resolve
+from array import array
+from collections import OrderedDict
+from fractions import Fraction
+from math import floor, gcd
+import bisect, logging, numpy as np, numbers, sys, threading
 
-class BaseSegment:
+log = logging.getLogger(__name__)
 
-    def __init__(self, initial, excess, width):
-        self.initial = initial
-        self.excess = excess
-        self.width = width
+class Segments:
+    'Parallel columns of numeric segments, frozen into arrays once parsing is done.'
 
-    def getvalue(self, frame, xadjust):
-        return self.unbiased(frame)
+    flat, slope, biased = range(3)
 
-class FlatSegment(BaseSegment):
+    def __init__(self):
+        self.frames = [] # First is always 0, but it's convenient.
+        self.kinds = []
+        self.initials = []
+        self.excesses = []
+        self.perframes = []
+        self.biases = []
+        self.len = 0
 
-    def unbiased(self, frame):
-        return self.initial
+    def add(self, kind, initial, excess, width):
+        self.frames.append(self.len)
+        self.kinds.append(kind)
+        self.initials.append(initial)
+        self.excesses.append(excess)
+        self.perframes.append(0 * initial)
+        self.biases.append(0)
+        self.len += width
+
+    def _settarget(self, index, width, target):
+        kind = self.kinds[index]
+        if self.flat != kind:
+            self.perframes[index] = perframe = (target - self.initials[index]) / (self.excesses[index] + width)
+            if self.biased == kind:
+                self.biases[index] = float(np.sign(perframe)) / -2
 
     def settarget(self, target):
-        pass
-
-class Segment(BaseSegment):
+        self._settarget(-1, self.len - self.frames[-1], target)
+
+    def freeze(self):
+        self.framearray, self.frames = _frozen(self.frames, float, 'd')
+        self.kinds, kinds = _frozen(self.kinds, np.int8, 'b')
+        self.initials, initials = _frozen(self.initials, float, 'd')
+        shape = (-1,) + (1,) * (self.initials.ndim - 1)
+        excesses, excessscalars = _frozen(self.excesses, float, 'd')
+        self.excesses = excesses.reshape(shape)
+        self.perframes, perframes = _frozen(self.perframes, float, 'd')
+        biases, biasscalars = _frozen(self.biases, float, 'd')
+        self.biases = biases.reshape(shape)
+        self.scalars = kinds, initials, excessscalars, perframes, biasscalars
 
-    def unbiased(self, frame):
-        return self.initial + (self.excess + frame) * self.perframe
-
-    def settarget(self, target):
-        self.perframe = (target - self.initial) / (self.excess + self.width)
+    def init(self, segments, initials):
+        self.frames = list(segments.frames)
+        self.kinds = list(segments.kinds)
+        self.initials = list(initials)
+        self.excesses = list(segments.excesses.reshape(-1))
+        self.perframes = [0 * i for i in self.initials]
+        self.biases = [0] * len(self.kinds)
+        self.len = segments.len
+        n = len(self.kinds)
+        for i in range(n):
+            self._settarget(i, (self.frames[i + 1] if i + 1 < n else self.len) - self.frames[i], self.initials[(i + 1) % n])
+        self.freeze()
 
-class BiasSegment(Segment):
+    def empty(self):
+        return not self.frames
 
-    def getvalue(self, frame, xadjust):
-        return super().getvalue(frame, xadjust) + self.bias
+    def cursor(self):
+        return Cursor(self)
 
-    def settarget(self, target):
-        super().settarget(target)
-        self.bias = float(np.sign(self.perframe)) / -2
+    def valueat(self, i, absframe, relframe, xadjust):
+        kinds, initials, excesses, perframes, biases = self.scalars
+        if self.flat == kinds[i]:
+            return initials[i]
+        return initials[i] + (excesses[i] + (relframe - self.frames[i])) * perframes[i] + biases[i]
 
-class Segments:
+    def forframe(self, absframe, xadjust):
+        relframe = absframe % self.len
+        return self.valueat(bisect.bisect(self.frames, relframe) - 1, absframe, relframe, xadjust)
+
+    def forframes(self, absframes, xadjust):
+        relframes = absframes % self.len
+        indices = np.searchsorted(self.framearray, relframes, side = 'right') - 1
+        localframes = relframes - self.framearray[indices]
+        localframes = localframes.reshape(localframes.shape + (1,) * (self.initials.ndim - 1))
+        return self.initials[indices] + (self.excesses[indices] + localframes) * self.perframes[indices] + self.biases[indices]
+
+def _frozen(values, dtype, typecode):
+    'Read-only array of the values, and what to index for the scalar path: if 1-D an array.array sharing its buffer, as numpy scalar arithmetic is slow.'
+    column = np.array(values, dtype = dtype)
+    if 1 == column.ndim:
+        scalars = array(typecode, column.tobytes())
+        column = np.frombuffer(scalars, dtype = dtype)
+    else:
+        scalars = column
+    column.flags.writeable = False
+    return column, scalars
+
+class EventSegments:
 
     def __init__(self):
         self.frames = [] # First is always 0, but it's convenient.
@@ -65,34 +128,67 @@ class Segments:
         self.segments.append(segment)
         self.len += segment.width
 
-    def init(self, segments, initials):
-        self.frames = segments.frames.copy()
-        self.segments = [type(s)(i, s.excess, s.width) for s, i in zip(segments.segments, initials)]
-        self.len = segments.len
-        n = len(self.segments)
-        for i in range(n):
-            if i + 1 < n:
-                t = self.segments[i + 1]
-            else:
-                t = self.segments[0]
-            self.segments[i].settarget(t.initial)
+    def cursor(self):
+        return Cursor(self)
 
-    def empty(self):
-        return not self.frames
+    def valueat(self, i, absframe, relframe, xadjust):
+        return self.segments[i].getvalue(relframe - self.frames[i], absframe - relframe + xadjust)
+
+    def forframe(self, absframe, xadjust):
+        relframe = absframe % self.len
+        return self.valueat(bisect.bisect(self.frames, relframe) - 1, absframe, relframe, xadjust)
+
+    def forframes(self, absframes, xadjust):
+        relframes = absframes % self.len
+        indices = np.searchsorted(self.frames, relframes, side = 'right') - 1
+        values = np.empty(len(indices), dtype = object)
+        for k, (i, relframe, x) in enumerate(zip(indices, relframes, np.broadcast_to(absframes - relframes + xadjust, indices.shape))):
+            values[k] = self.segments[i].getvalue(relframe - self.frames[i], x)
+        return values
 
-    def at(self, index):
-        return self.frames[index], self.segments[index]
+class Cursor:
+    'Drop-in for segments that remembers the last segment found, so lookups are cheap while frames mostly increase.'
+
+    def __init__(self, segments):
+        self.frames = list(segments.frames)
+        self.len = segments.len
+        self.segments = segments
+        self.index = 0
+
+    def __getattr__(self, name): # Anything else a script may use, such as initials.
+        if 'segments' == name: # Not initialised, e.g. during copy.
+            raise AttributeError(name)
+        return getattr(self.segments, name)
+
+    def _find(self, relframe):
+        frames = self.frames
+        i = self.index
+        n = len(frames)
+        if frames[i] <= relframe:
+            for j in range(i, min(i + 2, n)):
+                if j + 1 == n or relframe < frames[j + 1]:
+                    return j
+        return bisect.bisect(frames, relframe) - 1 # Seek or wrap-around.
 
     def forframe(self, absframe, xadjust):
         relframe = absframe % self.len
-        sectionframe, section = self.at(bisect.bisect(self.frames, relframe) - 1)
-        return section.getvalue(relframe - sectionframe, absframe - relframe + xadjust)
+        self.index = i = self._find(relframe)
+        return self.segments.valueat(i, absframe, relframe, xadjust)
+
+    def forframes(self, absframes, xadjust):
+        return self.segments.forframes(absframes, xadjust)
 
 class Operators:
 
+    period = None # Repeat period in beats as a Fraction, where known.
+
     def __getitem__(self, frame):
         return Slice(self, frame) if isinstance(frame, slice) else self.getitem(frame, 0)
 
+    def getblock(self, frames):
+        'Evaluate at every frame in the given array, returning an array of values.'
+        return self.getitems(np.asarray(frames, dtype = float), 0)
+
     def __add__(self, that):
         return Sum(self, that)
 
@@ -122,14 +218,14 @@ class Operators:
         degreetoindex = {}
         degrees = []
         refs = []
-        for s in self.segments.segments:
-            degree = tuple(s.initial[1:])
+        for initial in self.segments.initials:
+            degree = tuple(initial[1:])
             if degree in degreetoindex:
                 index = degreetoindex[degree]
             else:
                 degreetoindex[degree] = index = len(degrees)
                 degrees.append(np.array((0,) + degree))
-            refs.append((index, s.initial[0]))
+            refs.append((index, initial[0]))
         invs = []
         for _ in range(len(degrees)):
             segments = Segments()
@@ -138,8 +234,12 @@ class Operators:
             degrees.append(degrees.pop(0) + np.array([1, 0, 0]))
         return invs
 
+    def event(self, speed, frame):
+        table = tabulation.get(self, speed, frame % 1)
+        return self.of(speed)[frame] if table is None else table[frame]
+
     def apply(self, speed, frame, chips):
-        self.of(speed)[frame].perform(frame, speed, chips, self.kwargs)
+        self.event(speed, frame).perform(frame, speed, chips, self.kwargs)
 
 class EventSegment:
 
@@ -172,7 +272,7 @@ class Event:
                 else:
                     key = self.namespace, name
                     if key in kwargs:
-                        yield name, (kwargs[key] >> -self.absframe).of(speed) >> shift
+                        yield name, Tabulated(resolve(kwargs[key]), speed, self.absframe, shift)
         if self.onframes is None:
             if self.program.onparams is not None:
                 note.on(**dict(noteargs(self.program.onparams, 0, **chips, onframes = None)))
@@ -202,8 +302,50 @@ class Overlay:
         for e in self.e1, self.e2:
             e.perform(*args)
 
+def _select(mask, frames, shift1, shift2, getitems1, getitems2):
+    shift1 = np.broadcast_to(shift1, frames.shape)
+    shift2 = np.broadcast_to(shift2, frames.shape)
+    values1 = getitems1(frames[mask], shift1[mask])
+    values2 = getitems2(frames[~mask], shift2[~mask])
+    values = np.empty(frames.shape + values1.shape[1:], dtype = np.result_type(values1, values2))
+    values[mask] = values1
+    values[~mask] = values2
+    return values
+
+def _period(p):
+    return None if isinstance(p, Lazy) else p.period # Lazy may change, so don't tabulate.
+
+def lazies(obj):
+    'Every Lazy that obj depends on, with what it resolves to now.'
+    found = []
+    _lazies(obj, found, set())
+    return found
+
+def _lazies(obj, found, seen):
+    if isinstance(obj, Lazy):
+        if id(obj) not in seen:
+            seen.add(id(obj))
+            target = obj._resolve()
+            found.append((obj, target))
+            _lazies(target, found, seen)
+    elif isinstance(obj, tuple):
+        for x in obj:
+            _lazies(x, found, seen)
+    elif isinstance(obj, Operators):
+        for x in vars(obj).values():
+            _lazies(x, found, seen)
+
 class Binary(Operators):
 
+    @property
+    def period(self):
+        p1 = _period(self.p1)
+        p2 = _period(self.p2)
+        if p1 is not None and p2 is not None:
+            x = p1.numerator * p2.denominator
+            y = p2.numerator * p1.denominator
+            return Fraction(x * y // gcd(x, y), p1.denominator * p2.denominator)
+
     def __init__(self, p1, p2):
         self.p1 = p1
         self.p2 = p2
@@ -219,6 +361,9 @@ class Sum(Binary):
     def getitem(self, frame, shift):
         return self.p1.getitem(frame, shift) + self.p2.getitem(frame, shift)
 
+    def getitems(self, frames, shift):
+        return self.p1.getitems(frames, shift) + self.p2.getitems(frames, shift)
+
 class Diff(Binary):
 
     @property
@@ -228,6 +373,9 @@ class Diff(Binary):
     def getitem(self, frame, shift):
         return self.p1.getitem(frame, shift) - self.p2.getitem(frame, shift)
 
+    def getitems(self, frames, shift):
+        return self.p1.getitems(frames, shift) - self.p2.getitems(frames, shift)
+
 class Mul(Binary):
 
     @property
@@ -237,6 +385,9 @@ class Mul(Binary):
     def getitem(self, frame, shift):
         return self.p1.getitem(frame, shift) * self.p2.getitem(frame, shift)
 
+    def getitems(self, frames, shift):
+        return self.p1.getitems(frames, shift) * self.p2.getitems(frames, shift)
+
 class Merge(Binary):
 
     @property
@@ -254,6 +405,14 @@ class Merge(Binary):
         y = self.p2.getitem(frame, shift)
         return Overlay(x, y)
 
+    def getitems(self, frames, shift):
+        xs = self.p1.getitems(frames, shift)
+        ys = self.p2.getitems(frames, shift)
+        values = np.empty(len(xs), dtype = object)
+        for k, (x, y) in enumerate(zip(xs, ys)):
+            values[k] = Overlay(x, y)
+        return values
+
 class RShift(Operators):
 
     @property
@@ -268,6 +427,11 @@ class RShift(Operators):
     def len(self):
         return self.p.len
 
+    @property
+    def period(self):
+        if not isinstance(self.frames, Lazy):
+            return _period(self.p)
+
     def __init__(self, p, frames):
         self.p = p
         self.frames = frames
@@ -275,6 +439,9 @@ class RShift(Operators):
     def getitem(self, frame, shift):
         return self.p.getitem(frame, self.frames + shift)
 
+    def getitems(self, frames, shift):
+        return self.p.getitems(frames, self.frames + shift)
+
 class Repeat(Operators):
 
     @property
@@ -285,6 +452,10 @@ class Repeat(Operators):
     def kwargs(self):
         return self.p.kwargs
 
+    @property
+    def period(self):
+        return _period(self.p)
+
     def __init__(self, p, times):
         self.len = p.len * times
         self.p = p
@@ -293,6 +464,9 @@ class Repeat(Operators):
     def getitem(self, frame, shift):
         return self.p.getitem(frame, shift)
 
+    def getitems(self, frames, shift):
+        return self.p.getitems(frames, shift)
+
 class Of(Operators):
 
     kwargs = {} # TODO: Implement.
@@ -301,6 +475,12 @@ class Of(Operators):
     def len(self):
         return self.p.len * self.beat
 
+    @property
+    def period(self):
+        period = _period(self.p)
+        if period is not None and not isinstance(self.beat, Lazy):
+            return period * Fraction(self.beat)
+
     @property
     def mulcls(self):
         return self.p.mulcls
@@ -312,6 +492,9 @@ class Of(Operators):
     def getitem(self, frame, shift):
         return self.p.getitem(frame / self.beat, shift / self.beat)
 
+    def getitems(self, frames, shift):
+        return self.p.getitems(frames / self.beat, shift / self.beat)
+
 class Concat(Binary):
 
     kwargs = {} # TODO LATER: Implement.
@@ -320,6 +503,8 @@ class Concat(Binary):
     def len(self):
         return self.p1.len + self.p2.len
 
+    period = None # Only the second part loops.
+
     @property
     def mulcls(self):
         mulcls, = set(p.mulcls for p in [self.p1, self.p2])
@@ -332,6 +517,10 @@ class Concat(Binary):
         else:
             return self.p2.getitem(frame, shift + split)
 
+    def getitems(self, frames, shift):
+        split = self.p1.segments.len
+        return _select(frames - shift < split, frames, shift, shift + split, self.p1.getitems, self.p2.getitems)
+
 class Then(Binary):
 
     @property
@@ -343,6 +532,16 @@ class Then(Binary):
     def len(self):
         return self.len1.len + self.len2.len
 
+    @property
+    def period(self):
+        p1 = _period(self.p1)
+        p2 = _period(self.p2)
+        if p1 and p2 and not any(isinstance(l, Lazy) for l in [self.len1, self.len2]):
+            len1 = Fraction(self.len1.len)
+            len2 = Fraction(self.len2.len)
+            if not (len1 % p1 or len2 % p2):
+                return len1 + len2
+
     def __init__(self, p1, p2, len1, len2):
         super().__init__(p1, p2)
         self.kwargs = {name: Then(
@@ -363,12 +562,24 @@ class Then(Binary):
         else:
             return self.p2.getitem(frame, shift + self.len1.len * (1 + loop))
 
+    def getitems(self, frames, shift):
+        split = self.len1.len
+        total = split + self.len2.len
+        loop = (frames - shift) // total
+        return _select((frames - shift) % total < split, frames, shift + self.len2.len * loop, shift + self.len1.len * (1 + loop), self.p1.getitems, self.p2.getitems)
+
 class Slice(Operators):
 
     @property
     def mulcls(self):
         return self.p.mulcls
 
+    @property
+    def period(self):
+        period = _period(self.p)
+        if period and not any(isinstance(x, Lazy) for x in [self.start, self.stop]) and not Fraction(self.p.len) % period:
+            return Fraction(self.len)
+
     def __init__(self, p, slice):
         def readslice(ref, adj):
             return ref if adj is None else (ref + adj if adj < 0 else adj)
@@ -382,3 +593,144 @@ class Slice(Operators):
     def getitem(self, frame, shift):
         loop = (frame - shift) // self.len
         return self.p.getitem(frame, shift - self.start - (self.p.len - self.len) * loop)
+
+    def getitems(self, frames, shift):
+        loop = (frames - shift) // self.len
+        return self.p.getitems(frames, shift - self.start - (self.p.len - self.len) * loop)
+
+class Tabulated(Operators):
+    'Equivalent to (p >> -absframe).of(speed) >> shift, served from tabulation where possible.'
+
+    kwargs = {}
+
+    @property
+    def mulcls(self):
+        return self.p.mulcls
+
+    def __init__(self, p, speed, absframe, shift):
+        self.len = p.len * speed
+        self.p = p
+        self.speed = speed
+        self.absframe = absframe
+        self.shift = shift
+
+    def getitem(self, frame, shift):
+        tableframe = frame - shift - self.shift + self.absframe * self.speed
+        table = tabulation.get(self.p, self.speed, tableframe % 1)
+        if table is None or table.delta is not None: # Event absframes would lack our shift.
+            return self.p.getitem(frame / self.speed, (shift + self.shift) / self.speed - self.absframe)
+        return table[tableframe]
+
+    def getitems(self, frames, shift):
+        return self.p.getitems(frames / self.speed, (shift + self.shift) / self.speed - self.absframe)
+
+class Table:
+
+    def __init__(self, values, phase, delta):
+        self.values = values
+        self.phase = phase
+        self.delta = delta
+
+    def __getitem__(self, frame):
+        loop, index = divmod(int(frame - self.phase), len(self.values))
+        value = self.values[index]
+        if self.delta is None or not loop:
+            return value
+        return Event(value.absframe + loop * self.delta, value.onframes, value.program, value.namespace)
+
+class Tabulation:
+    'LRU cache of one period of a pattern at a given speed and frame phase, within a memory budget in bytes.'
+
+    warmup = 4
+    maxpending = 1000
+    nominalsize = 100
+
+    def __init__(self, budget):
+        self.tables = OrderedDict()
+        self.pending = {}
+        self.requested = OrderedDict() # Keys that passed warmup, for build to tabulate in order.
+        self.size = 0
+        self.budget = budget
+        self.bypass = 0 # While positive every pattern is evaluated, for example so that a profiler sees each node.
+        self.lock = threading.Lock() # The tabulator thread also gets here.
+        self.cond = threading.Condition(self.lock)
+
+    def get(self, pattern, speed, phase):
+        'Return the table if it has been built, otherwise None and maybe request it.'
+        if self.bypass:
+            return
+        key = pattern, speed, phase
+        with self.lock:
+            try:
+                table, _ = self.tables[key]
+            except KeyError:
+                pass
+            else:
+                self.tables.move_to_end(key)
+                return table
+            if key in self.requested:
+                return
+            count = self.pending.get(key, 0) + 1
+            if count < self.warmup:
+                if len(self.pending) >= self.maxpending:
+                    self.pending.clear()
+                self.pending[key] = count
+                return
+            self.pending.pop(key, None)
+            if len(self.requested) >= self.maxpending:
+                self.requested.popitem(False)
+            self.requested[key] = None
+            self.cond.notify_all()
+
+    def build(self):
+        'Tabulate the oldest requested key, if any, and return whether there was one. Call from a thread that can afford it.'
+        with self.lock:
+            if not self.requested:
+                return False
+            key, _ = self.requested.popitem(False)
+        try:
+            table, size = self._tabulate(*key)
+        except Exception:
+            log.debug('Failed to tabulate:', exc_info = True) # The frame thread will encounter it too.
+            table, size = None, self.nominalsize
+        with self.lock:
+            if key not in self.tables:
+                while self.tables and self.size + size > self.budget:
+                    _, (_, evicted) = self.tables.popitem(False)
+                    self.size -= evicted
+                if size <= self.budget:
+                    self.tables[key] = table, size
+                    self.size += size
+        return True
+
+    def _tabulate(self, pattern, speed, phase):
+        period = pattern.period
+        if period is None:
+            return None, self.nominalsize
+        n = period * Fraction(speed)
+        if not n or 1 != n.denominator:
+            return None, self.nominalsize
+        n = int(n)
+        if n * self.nominalsize > self.budget:
+            return None, self.nominalsize
+        p = pattern.of(speed)
+        values = [p[phase + i] for i in range(n)]
+        sample = values[0]
+        delta = None
+        if isinstance(sample, Event):
+            deltas = []
+            for value, later in zip(values, (p[phase + n + i] for i in range(n))):
+                if not (isinstance(later, Event) and value.onframes == later.onframes and value.program is later.program):
+                    return None, self.nominalsize
+                deltas.append(later.absframe - value.absframe)
+            delta = deltas[0]
+            if not np.allclose(deltas, delta):
+                return None, self.nominalsize
+        elif isinstance(sample, np.ndarray):
+            for value in values:
+                value.flags.writeable = False
+        elif not isinstance(sample, numbers.Real):
+            return None, self.nominalsize
+        return Table(values, phase, delta), sys.getsizeof(values) + n * (sys.getsizeof(sample) + self.nominalsize)
+
+tabulation = Tabulation(1 << 24)
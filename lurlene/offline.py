@@ -0,0 +1,158 @@
+# Copyright 2019 Andrzej Cichocki
+
+# This file is part of Lurlene.
+#
+# Lurlene is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Lurlene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Lurlene.  If not, see <http://www.gnu.org/licenses/>.
+
+from .bridge import LiveCodingBridge
+from .context import Context
+from .model import tabulation
+from .util import Config
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from types import SimpleNamespace
+import logging, math
+
+class Recorder:
+    'Collects the attribute writes made to its proxies, tagged with frame number.'
+
+    def __init__(self):
+        self.frameindex = 0
+        self.writes = []
+
+    def proxies(self, chipname, count):
+        return [RecordingProxy(self, chipname, channel) for channel in range(count)]
+
+class RecordingProxy:
+
+    def __init__(self, recorder, chipname, channel):
+        object.__setattr__(self, '_recorder', recorder)
+        object.__setattr__(self, '_key', (chipname, channel))
+        object.__setattr__(self, '_values', {})
+
+    def blank(self):
+        self._values.clear()
+
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self._values[name] = value
+        self._recorder.writes.append((self._recorder.frameindex, *self._key, name, value))
+
+def loopframecount(bridge):
+    return bridge.context.sections.totalframecount
+
+def render(bridge, chips, recorder, framecount = None, startframe = None):
+    'Run the bridge as fast as possible for the given number of frames, or until the end of the song if it does not loop. Tabulation is bypassed so that output does not depend on when tables get built.'
+    if framecount is None and bridge.loop:
+        raise ValueError('Looping song needs a framecount.')
+    tabulation.bypass += 1
+    try:
+        for _ in islice(bridge.frames(chips, startframe), framecount):
+            recorder.frameindex += 1
+    finally:
+        tabulation.bypass -= 1
+    return recorder.writes
+
+def offlineconfig(tuning = None, ignoreloop = False, section = None, **lurlene):
+    'Config to run a bridge with outside of a live session, the Lurlene settings for live use are off unless given.'
+    config = Config()
+    config.tuning = tuning
+    config.Lurlene = SimpleNamespace(**dict(dict(lazy = False, deadline = None, prewarm = 0, debounce = 0), **lurlene))
+    config.ignoreloop = ignoreloop
+    config.section = section
+    return config
+
+def load(config, text):
+    context = Context(config)
+    context.update(text)
+    context.flip()
+    return LiveCodingBridge(config, context)
+
+def _renderslice(config, text, chipcounts, startframe, frameindex, framecount):
+    recorder = Recorder()
+    recorder.frameindex = frameindex
+    return render(load(config, text), {name: recorder.proxies(name, n) for name, n in chipcounts.items()}, recorder, framecount, startframe)
+
+def _slices(sections, startframe, framecount, bias, chunksize):
+    total = sections.totalframecount
+    if chunksize is not None:
+        cuts = range(chunksize, framecount, chunksize)
+    elif total:
+        cuts = set()
+        loop = startframe // total
+        while loop * total < startframe + framecount:
+            for end in sections.sectionends:
+                k = math.ceil(loop * total + end - bias - startframe)
+                if 0 < k < framecount:
+                    cuts.add(k)
+            loop += 1
+    else:
+        cuts = []
+    bounds = [0, *sorted(cuts), framecount]
+    return [(i, j - i) for i, j in zip(bounds, bounds[1:])]
+
+def renderparallel(config, text, chipcounts, framecount = None, chunksize = None, workers = None):
+    'Like render but farm out slices of the song, at section boundaries or every chunksize frames, to worker processes.'
+    bridge = load(config, text)
+    startframe = bridge._initialframe()
+    if framecount is None:
+        if bridge.loop:
+            raise ValueError('Looping song needs a framecount.')
+        framecount = max(0, math.ceil(loopframecount(bridge) - startframe - bridge.bias))
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(_renderslice, config, text, chipcounts, startframe + i, i, n)
+                for i, n in _slices(bridge.context.sections, startframe, framecount, bridge.bias, chunksize)]
+        return [w for f in futures for w in f.result()]
+
+def main_lurlene_render():
+    parser = ArgumentParser()
+    parser.add_argument('--chip', action = 'append', default = [], help = 'name and channel count, e.g. ym=3')
+    parser.add_argument('--loops', type = int, default = 1)
+    parser.add_argument('--frames', type = int)
+    parser.add_argument('--section')
+    parser.add_argument('--ignoreloop', action = 'store_true')
+    parser.add_argument('--lazy', action = 'store_true')
+    parser.add_argument('--tuning', type = float, default = 440)
+    parser.add_argument('--workers', type = int, help = 'render in this many processes')
+    parser.add_argument('--chunk', type = int, help = 'frames per process job, default is per section')
+    parser.add_argument('path')
+    args = parser.parse_args()
+    logging.basicConfig(format = "[%(levelname)s] %(message)s", level = logging.INFO)
+    config = offlineconfig(args.tuning, args.ignoreloop, args.section, lazy = args.lazy)
+    with open(args.path) as f:
+        text = f.read()
+    chipcounts = {}
+    for chip in args.chip:
+        name, count = chip.split('=')
+        chipcounts[name] = int(count)
+    bridge = load(config, text)
+    framecount = args.frames
+    if framecount is None and not args.ignoreloop:
+        framecount = math.ceil(args.loops * loopframecount(bridge))
+    if args.workers is None:
+        recorder = Recorder()
+        writes = render(bridge, {name: recorder.proxies(name, n) for name, n in chipcounts.items()}, recorder, framecount)
+    else:
+        writes = renderparallel(config, text, chipcounts, framecount, args.chunk, args.workers)
+    for write in writes:
+        print(*write, sep = '\t')
+
+if '__main__' == __name__:
+    main_lurlene_render()
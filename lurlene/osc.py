@@ -16,30 +16,15 @@
 # along with Lurlene.  If not, see <http://www.gnu.org/licenses/>.
 
 from .context import Context
+from .latency import now
 from .util import Config
 from diapyr import types
 from splut.bg import SimpleBackground
-import logging, socket, timelyOSC
+import asyncio, logging, select, socket, threading, timelyOSC
 
 log = logging.getLogger(__name__)
 
-class OSCClient:
-
-    def __init__(self, host, port, bufsize, handlers):
-        self.address = host, port
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # XXX: Close it?
-        self.sock.bind(self.address)
-        self.bufsize = bufsize
-        self.handlers = handlers
-
-    def pumponeortimeout(self):
-        try:
-            bytes, address = self.sock.recvfrom(self.bufsize)
-            self._message(address, [], timelyOSC.parse(bytes))
-        except socket.timeout:
-            pass
-        except Exception:
-            log.exception('Failed to receive message:')
+class Dispatch:
 
     def _message(self, udpaddr, timetags, message):
         try:
@@ -52,17 +37,142 @@ class OSCClient:
         except KeyError:
             log.warning("Unhandled message: %s", message)
             return
-        handler.handle(timetags, message, lambda reply: self.sock.sendto(reply, udpaddr))
+        self._handle(handler, timetags, message, udpaddr)
 
     def _elements(self, udpaddr, timetags, elements):
         for element in elements:
             self._message(udpaddr, timetags, element)
 
+class OSCClient(Dispatch):
+
+    def __init__(self, host, port, bufsize, handlers):
+        self.address = host, port
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # XXX: Close it?
+        self.sock.bind(self.address)
+        self.bufsize = bufsize
+        self.buffer = bytearray(bufsize + 1) # One spare byte to detect truncation.
+        self.handlers = handlers
+        self.received = 0
+        self.oversized = 0
+        self.dropped = 0
+
+    def pumponeortimeout(self):
+        'Wait for a datagram, then handle it and any others already pending as a batch.'
+        try:
+            batch = self._drain()
+        except socket.timeout:
+            return
+        except Exception:
+            log.exception('Failed to receive message:')
+            return
+        for bytes, address in batch:
+            try:
+                message = timelyOSC.parse(bytes)
+            except Exception:
+                log.exception('Failed to parse message:')
+                self.dropped += 1
+                continue
+            try:
+                self._message(address, [], message)
+            except Exception:
+                log.exception('Failed to handle message:')
+
+    def _drain(self):
+        batch = []
+        view = memoryview(self.buffer)
+        while True:
+            n, address = self.sock.recvfrom_into(self.buffer)
+            self.received += 1
+            if n > self.bufsize:
+                log.warning("Dropped datagram over %s bytes from: %s", self.bufsize, address)
+                self.oversized += 1
+                self.dropped += 1
+            else:
+                batch.append((bytes(view[:n]), address))
+            if not select.select([self.sock], [], [], 0)[0]:
+                return batch
+
+    def _handle(self, handler, timetags, message, udpaddr):
+        handler.handle(timetags, message, lambda reply: self.sock.sendto(reply, udpaddr))
+
     def interrupt(self):
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
             sock.sendto(timelyOSC.Message('/interrupt', []).ser(), self.address)
 
-class Handler: pass
+class OSCProtocol(Dispatch, asyncio.DatagramProtocol):
+
+    def __init__(self, bufsize, handlers):
+        self.bufsize = bufsize
+        self.handlers = handlers
+        self.received = 0
+        self.oversized = 0
+        self.dropped = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        self.received += 1
+        if len(data) > self.bufsize:
+            log.warning("Dropped datagram over %s bytes from: %s", self.bufsize, address)
+            self.oversized += 1
+            self.dropped += 1
+            return
+        try:
+            message = timelyOSC.parse(data)
+        except Exception:
+            log.exception('Failed to parse message:')
+            self.dropped += 1
+            return
+        try:
+            self._message(address, [], message)
+        except Exception:
+            log.exception('Failed to handle message:')
+
+    def _handle(self, handler, timetags, message, udpaddr):
+        handler.handle(timetags, message, lambda reply: self.transport.sendto(reply, udpaddr))
+
+class AsyncOSCServer:
+    'Serve any number of OSC addresses on one asyncio loop, handlers must not block it.'
+
+    def __init__(self, addresses, bufsize, handlers):
+        self.addresses = addresses
+        self.bufsize = bufsize
+        self.handlers = handlers
+        self.loop = asyncio.new_event_loop()
+        self.stopped = self.loop.create_future()
+        self.ready = threading.Event()
+        self.protocols = []
+
+    def interrupt(self):
+        self.loop.call_soon_threadsafe(lambda: self.stopped.done() or self.stopped.set_result(None))
+
+    def run(self):
+        try:
+            self.loop.run_until_complete(self._serve())
+        finally:
+            self.loop.close()
+
+    async def _serve(self):
+        transports = []
+        try:
+            for address in self.addresses:
+                transport, protocol = await self.loop.create_datagram_endpoint(lambda: OSCProtocol(self.bufsize, self.handlers), local_addr = address)
+                transports.append(transport)
+                self.protocols.append(protocol)
+            self.ready.set()
+            await self.stopped
+        finally:
+            for transport in transports:
+                transport.close()
+
+class Handler:
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
 
 class OSCListen(SimpleBackground):
 
@@ -73,27 +183,103 @@ class OSCListen(SimpleBackground):
         self.handlers = {a: h for h in handlers for a in h.addresses}
 
     def start(self):
+        for handler in self._distincthandlers():
+            handler.start()
         config = self.config.OSC
+        if getattr(config, 'asyncio', False): # Otherwise a thread of our own.
+            super().start(self.asyncbg, AsyncOSCServer([(config.host, config.port)], config.bufsize, self.handlers))
+            return
         super().start(self.bg, OSCClient(
                 *(getattr(config, name) for name in ['host', 'port', 'bufsize']),
                 self.handlers))
 
+    def stop(self):
+        super().stop()
+        for handler in self._distincthandlers():
+            handler.stop()
+
+    def _distincthandlers(self):
+        return {id(h): h for h in self.handlers.values()}.values()
+
     def bg(self, client):
         while not self.quit:
             client.pumponeortimeout()
 
+    def asyncbg(self, server):
+        server.run() # Returns as soon as quit fires.
+
+class UpdateQueue(SimpleBackground):
+    'Apply whole-buffer updates on a thread of our own, skipping any superseded before we got to them or within the debounce window.'
+
+    daemon = True
+
+    def __init__(self, context, debounce):
+        super().__init__()
+        self.context = context
+        self.debounce = int(debounce * 1e9)
+        self.cond = threading.Condition()
+        self.pending = None
+        self.deadline = None
+        self.received = 0
+        self.coalesced = 0
+        self.applied = 0
+
+    def put(self, text):
+        with self.cond:
+            self.received += 1
+            if self.pending is not None:
+                self.coalesced += 1
+            self.pending = text
+            self.deadline = now() + self.debounce
+            self.cond.notify_all()
+
+    def start(self):
+        super().start(self.bg, self)
+
+    def interrupt(self):
+        with self.cond:
+            self.cond.notify_all()
+
+    def bg(self, _):
+        # An update in progress is allowed to finish, stop waits for it:
+        while True:
+            with self.cond:
+                while not self.quit and self.pending is None:
+                    self.cond.wait()
+                while not self.quit: # Each put pushes the deadline back.
+                    remaining = self.deadline - now()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining / 1e9)
+                if self.quit:
+                    break
+                text, self.pending = self.pending, None
+            try:
+                self.context.update(text)
+            except Exception:
+                log.exception('Update failed:')
+            with self.cond:
+                self.applied += 1
+                self.cond.notify_all()
+
 class LurleneHandler(Handler):
 
     addresses = '/lurlene',
 
-    @types(Context)
-    def __init__(self, context):
-        self.context = context
+    @types(Config, Context)
+    def __init__(self, config, context):
+        self.queue = UpdateQueue(context, getattr(config.Lurlene, 'debounce', 0)) # Seconds to wait for a newer update.
+
+    def start(self):
+        self.queue.start()
+
+    def stop(self):
+        self.queue.stop()
 
     def handle(self, timetags, message, reply):
         try:
             text, = message.args
-            self.context.update(text)
+            self.queue.put(text)
         except Exception:
             log.exception('Update failed:')
 
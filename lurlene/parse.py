@@ -15,7 +15,8 @@
 # You should have received a copy of the GNU General Public License
 # along with Lurlene.  If not, see <http://www.gnu.org/licenses/>.
 
-from .model import Operators, Segments, FlatSegment, BiasSegment, Segment, Concat, EventSegment, Repeat, Mul
+from .model import Operators, Segments, Concat, EventSegment, EventSegments, Repeat, Mul
+from .util import LRU
 from diapyr.util import innerclass
 from fractions import Fraction
 import re, numpy as np, inspect, itertools
@@ -24,25 +25,50 @@ class Script(Operators):
 
     mulcls = Repeat
 
+    @property
+    def period(self):
+        return Fraction(self.segments.len)
+
     def __init__(self, segments, kwargs):
         self.len = max(itertools.chain([segments.len], (s.len for s in kwargs.values())))
         self.segments = segments
         self.kwargs = kwargs
 
+    def cursor(self):
+        'Equivalent script with its own segment cursor, for when frames will mostly increase.'
+        return self._withsegments(self.segments.cursor())
+
+    def _withsegments(self, segments):
+        return Script(segments, self.kwargs)
+
     def getitem(self, frame, shift):
         return self.segments.forframe(frame - shift, shift)
 
+    def getitems(self, frames, shift):
+        return self.segments.forframes(frames - shift, shift)
+
 class StepScript(Script):
 
     mulcls = Mul
 
+    @property
+    def period(self):
+        if not self.step:
+            return super().period
+
     def __init__(self, segments, kwargs, step):
         super().__init__(segments, kwargs)
         self.step = step
 
+    def _withsegments(self, segments):
+        return StepScript(segments, self.kwargs, self.step)
+
     def getitem(self, frame, shift):
         return Value(super().getitem(frame, shift) + (frame - shift) // self.segments.len * self.step)
 
+    def getitems(self, frames, shift):
+        return super().getitems(frames, shift) + (frames - shift) // self.segments.len * self.step
+
 class Value(float):
 
     def pick(self, sequence):
@@ -50,11 +76,19 @@ class Value(float):
 
 class BadWordException(Exception): pass
 
+parsecache = LRU(10000) # Parsed segments are immutable so can be shared by every script with the same text.
+
 class Parse:
 
     def parse(self, script, successor):
+        return self.bind(parsecache.get(self.cachekey(script, successor), lambda: self._parse(script, successor)))
+
+    def bind(self, segments):
+        return segments
+
+    def _parse(self, script, successor):
         session = self.Session()
-        session.segments = Segments()
+        session.segments = self.segmentscls()
         for word in re.findall(r'[^\s|]+', script):
             session.parseword(word)
         session.wrap(successor)
@@ -62,6 +96,7 @@ class Parse:
 
 class VParse(Parse):
 
+    segmentscls = Segments
     pattern = re.compile('(?:([0-9.]+)x)?(-?[0-9.]+)?(#+|b+)?([+]+|-+)?(?:/(/)?([0-9.]*))?')
 
     def __init__(self, type, step, continuous):
@@ -69,6 +104,10 @@ class VParse(Parse):
         self.step = step
         self.continuous = continuous
 
+    def cachekey(self, script, successor):
+        # The successor segments are shared too, so their identity stands in for the successor:
+        return VParse, self.type, self.step, self.continuous, script, None if successor is None else successor.segments
+
     @innerclass
     class Session:
 
@@ -93,20 +132,19 @@ class VParse(Parse):
                 self._wrap(initial)
             hold = width - slide
             if hold > 0 or (not hold and not slide):
-                self.segments.add(FlatSegment(initial, None, hold))
+                self.segments.add(Segments.flat, initial, 0, hold)
             if slide:
-                self.segments.add((BiasSegment if bias else Segment)(initial, max(0, slide - width), min(width, slide)))
+                self.segments.add(Segments.biased if bias else Segments.slope, initial, max(0, slide - width), min(width, slide))
 
         def wrap(self, successor):
             if successor is None:
-                _, firstsection = self.segments.at(0)
-                self._wrap(firstsection.initial + self.step)
+                self._wrap(self.segments.initials[0] + self.step)
             else:
                 self._wrap(successor[0]) # TODO: Unit-test what effect step would have.
+            self.segments.freeze()
 
         def _wrap(self, value):
-            _, lastsection = self.segments.at(-1)
-            lastsection.settarget(value)
+            self.segments.settarget(value)
 
 def rebase(n, frombase = 1):
     return np.sign(n) * max(0, abs(n) - frombase)
@@ -143,12 +181,22 @@ def _readnumber(numstr, default):
 
 class EParse(Parse):
 
+    segmentscls = EventSegments
     pattern = re.compile('(?:([0-9]+)x)?(-?[0-9./]+)?(?:r([0-9./]*))?|([0-9./]*)z')
 
     def __init__(self, program, namespace):
         self.program = program
         self.namespace = namespace
 
+    def cachekey(self, script, successor):
+        return EParse, script # Successor has no effect, and program and namespace are bound after.
+
+    def bind(self, template):
+        segments = EventSegments()
+        for s in template.segments:
+            segments.add(EventSegment(s.relframe, s.onframes, s.width, s.program if s.program is silence else self.program, self.namespace))
+        return segments
+
     @innerclass
     class Session:
 
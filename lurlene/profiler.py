@@ -0,0 +1,117 @@
+# Copyright 2019 Andrzej Cichocki
+
+# This file is part of Lurlene.
+#
+# Lurlene is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Lurlene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Lurlene.  If not, see <http://www.gnu.org/licenses/>.
+
+from .latency import now
+from .model import Event, EventSegments, Operators, tabulation, Tabulated
+from .util import resolve
+import threading
+
+class Node:
+
+    def __init__(self, label, calls, time, children):
+        self.label = label
+        self.calls = calls
+        self.time = time # Cumulative seconds including children.
+        self.children = children
+
+    def lines(self, indent = ''):
+        yield "%s%s calls=%s time=%.6f" % (indent, self.label, self.calls, self.time)
+        for child in self.children:
+            yield from child.lines(indent + '  ')
+
+class Profiler:
+    'While active, count calls and cumulative time of getitem per pattern node and perform per program. Classes are only patched while active, so it costs nothing otherwise. Tabulation is bypassed while active, as a table hit would skip the nodes.'
+
+    def __init__(self):
+        self.stats = {}
+        self.originals = []
+        self.local = threading.local() # Keys with a call in progress on each thread.
+
+    def _classes(self):
+        pending = [Operators]
+        while pending:
+            cls = pending.pop()
+            pending.extend(cls.__subclasses__())
+            if 'getitem' in cls.__dict__ and cls is not Tabulated: # Tabulated is made per perform and delegates anyway.
+                yield cls, 'getitem', lambda node: node
+        yield Event, 'perform', lambda event: event.program
+
+    def _wrap(self, f, keyof):
+        stats = self.stats
+        local = self.local
+        def g(obj, *args):
+            key = keyof(obj)
+            active = local.__dict__.setdefault('active', set())
+            if key in active: # For example via super, only the outermost call counts.
+                return f(obj, *args)
+            active.add(key)
+            start = now()
+            try:
+                return f(obj, *args)
+            finally:
+                elapsed = now() - start
+                active.discard(key)
+                s = stats.get(key)
+                if s is None:
+                    stats[key] = [1, elapsed]
+                else:
+                    s[0] += 1
+                    s[1] += elapsed
+        return g
+
+    def __enter__(self):
+        for cls, name, keyof in self._classes():
+            f = cls.__dict__[name]
+            self.originals.append((cls, name, f))
+            setattr(cls, name, self._wrap(f, keyof))
+        tabulation.bypass += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        tabulation.bypass -= 1
+        while self.originals:
+            setattr(*self.originals.pop())
+
+    def _node(self, label, obj, path):
+        obj = resolve(obj)
+        if isinstance(obj, (tuple, list)):
+            children = [self._node(str(i), x, path) for i, x in enumerate(obj)]
+            children = [c for c in children if c is not None]
+            if children:
+                return Node(label, sum(c.calls for c in children), sum(c.time for c in children), children)
+            return
+        if not isinstance(obj, Operators) or id(obj) in path:
+            return
+        path = path | {id(obj)}
+        calls, time = self.stats.get(obj, (0, 0))
+        children = [self._node(name, value, path) for name, value in vars(obj).items()]
+        if isinstance(getattr(obj, 'segments', None), EventSegments):
+            for program in {s.program for s in obj.segments.segments}:
+                if program in self.stats:
+                    n, t = self.stats[program]
+                    children.append(Node("perform %s" % getattr(program.cls, '__name__', program.cls), n, t / 1e9, []))
+            children.extend(self._node(key[1], value, path) for key, value in obj.kwargs.items())
+        return Node("%s %s" % (label, type(obj).__name__), calls, time / 1e9, [c for c in children if c is not None])
+
+    def tree(self, namespace):
+        'Nodes keyed by global name for the patterns in the given namespace, for example the context globals.'
+        nodes = {}
+        for name, value in namespace.items():
+            node = self._node(name, value, frozenset())
+            if node is not None and node.calls:
+                nodes[name] = node
+        return nodes
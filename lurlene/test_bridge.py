@@ -15,9 +15,15 @@
 # You should have received a copy of the GNU General Public License
 # along with Lurlene.  If not, see <http://www.gnu.org/licenses/>.
 
-from .bridge import LiveCodingBridge
-from .context import Sections
+from .api import V
+from .bridge import LiveCodingBridge, SectionCursor, Tabulator
+from .context import Context, Sections
+from .model import tabulation
+from .offline import offlineconfig, Recorder
+from itertools import islice
+from types import SimpleNamespace
 from unittest import TestCase
+import threading, time
 
 class TestAdjustFrameIndex(TestCase):
 
@@ -32,18 +38,14 @@ class TestAdjustFrameIndex(TestCase):
     speed = 10
 
     def setUp(self):
-        class Config:
-            ignoreloop = None
-            section = None
-            chipchannels = None
-        self.b = LiveCodingBridge(Config(), self)
+        self.b = LiveCodingBridge(offlineconfig(), self)
         self.g = {}
 
     def get(self, name):
         return self.g[name]
 
     def adjust(self, *args):
-        return self.b._adjustframeindex(Sections(self.speed, self.oldsections), *args)
+        return self.b._adjustframeindex(Sections(self.speed, self.oldsections), self.sections, *args)
 
     @property
     def sections(self):
@@ -104,3 +106,216 @@ class TestAdjustFrameIndex(TestCase):
         self.assertEqual(100.5, self.adjust(100+55))
         self.assertEqual(100.5, self.adjust(100+110+55))
         self.assertEqual(100+120+120+50, self.adjust(100+110+110+50))
+
+    def test_newtuples(self):
+        self.oldsections = self.A, self.B, self.C
+        self.g['sections'] = tuple([*self.A]), tuple([*self.C]), tuple([*self.B]) # Same patterns in new tuples, like a resent literal.
+        self.assertEqual(100+120+55, self.adjust(100+55))
+        self.assertEqual(100+60, self.adjust(100+110+60))
+
+    def test_repeats(self):
+        self.oldsections = self.A, self.B, self.A, self.B
+        self.g['sections'] = self.B, self.A, self.C, self.B, self.A
+        self.assertEqual(110+50, self.adjust(50)) # Occurrences in order, where difflib would take the last A.
+        self.assertEqual(110+100+120+110+50, self.adjust(100+110+50))
+        self.assertEqual(110+100+120+55, self.adjust(100+110+100+55))
+
+    def test_noncontiguous(self):
+        D, E, X, Y = ((self.Pattern(n),) for n in [13, 14, 15, 16])
+        self.oldsections = self.A, self.B, self.C, D, E
+        self.g['sections'] = self.A, X, self.C, Y, E
+        self.assertEqual(100+.5, self.adjust(100+55))
+        self.assertEqual(100+150+60, self.adjust(100+110+60))
+        self.assertEqual(100+150+120+.5, self.adjust(100+110+120+65))
+        self.assertEqual(100+150+120+160+70, self.adjust(100+110+120+130+70))
+
+class TestSectionCursor(TestCase):
+
+    A = TestAdjustFrameIndex.A
+    B = TestAdjustFrameIndex.B
+    Z = TestAdjustFrameIndex.Pattern(0),
+
+    def _check(self, sections, frameindexes):
+        seeks = []
+        class Cursor(SectionCursor):
+            def _seek(self, *args):
+                seeks.append(args)
+                super()._seek(*args)
+        cursor = Cursor()
+        for frameindex in frameindexes:
+            self.assertEqual(sections.sectionandframe(frameindex), cursor.sectionandframe(sections, frameindex))
+        return len(seeks)
+
+    def test_steps(self):
+        sections = Sections(3, (self.A, self.Z, self.B, self.A))
+        self.assertEqual(1, self._check(sections, [x + .5 for x in range(200)]))
+        self.assertEqual(1, self._check(sections, [x + 1 / 3 for x in range(200)]))
+
+    def test_seek(self):
+        self.assertEqual(5, self._check(Sections(3, (self.A, self.B, self.A)), [.5, 1.5, 100.5, 101.5, 20.5, 21.5, 66.5, 29.5, 30.5]))
+
+    def test_resync(self):
+        sections = Sections(3, (self.A, self.B))
+        cursor = SectionCursor()
+        self.assertEqual((self.A, 29.5), cursor.sectionandframe(sections, 29.5))
+        sections.lengths[0] = 40
+        sections.ends[:] = 40, 73
+        sections.version += 1
+        self.assertEqual((self.A, 30.5), cursor.sectionandframe(sections, 30.5))
+        self.assertEqual((self.B, 0.5), cursor.sectionandframe(Sections(3, (self.B, self.A)), 0.5))
+
+class TestFrames(TestCase):
+
+    text = '''from lurlene import E, V
+class N:
+    def on(self, frame, chip, pitch):
+        chip.pitch = pitch[frame]
+A = E(N, '2 1', pitch = V('1 2 3')),
+B = E(N, '1', pitch = V('4')),
+speed = 2
+sections = [A, B]'''
+
+    def _writes(self):
+        config = offlineconfig()
+        context = Context(config, ())
+        context.update(self.text)
+        context.flip()
+        recorder = Recorder()
+        self.bridge = LiveCodingBridge(config, context)
+        frames = self.bridge.frames(dict(chip = recorder.proxies('chip', 1)))
+        for _ in islice(frames, 10):
+            recorder.frameindex += 1
+        context.update("B = E(N, '1', pitch = V('5')),\nsections = [A, B]")
+        for _ in islice(frames, 10):
+            recorder.frameindex += 1
+        frames.close()
+        return recorder.writes
+
+    def test_timings(self):
+        self._writes()
+        s = self.bridge.timings.summary()
+        self.assertEqual(20, s['frame']['count'])
+        self.assertEqual(19, s['flip']['count'])
+        self.assertEqual(20, s['channels']['A']['count'])
+
+    def test_lazydelete(self):
+        config = offlineconfig(lazy = True)
+        context = Context(config, ())
+        context.update(self.text.replace('[A, B]', '[(A,), (B,)]').replace('),\n', ')\n'))
+        context.flip()
+        recorder = Recorder()
+        frames = LiveCodingBridge(config, context).frames(dict(chip = recorder.proxies('chip', 1)))
+        for _ in islice(frames, 3):
+            recorder.frameindex += 1
+        context.update('del A')
+        with self.assertLogs('lurlene.util'):
+            for _ in islice(frames, 5):
+                recorder.frameindex += 1
+        frames.close()
+        self.assertEqual([1, 1, 2, 4, 4], [w[4] for w in recorder.writes if w[3] == 'pitch'])
+
+class TestPrewarm(TestCase):
+
+    def test_works(self):
+        config = offlineconfig(prewarm = 3)
+        context = Context(config, ())
+        context.update(TestFrames.text)
+        context.flip()
+        recorder = Recorder()
+        frames = LiveCodingBridge(config, context).frames(dict(chip = recorder.proxies('chip', 1)))
+        for _ in islice(frames, 2):
+            recorder.frameindex += 1
+        with self.assertLogs('lurlene.util') as cm:
+            context.update('''class Bad:
+    def on(self, frame, chip):
+        raise Exception('bad')
+C = E(Bad, '1'),
+sections = [C]''')
+        self.assertEqual(['ERROR:lurlene.util:Channel A update failed:'], [line.split('\n')[0] for line in cm.output])
+        self.assertEqual(2, len(recorder.writes)) # Only the real chips got written.
+        sections = context.cache['sections'][0][1]
+        context.flip()
+        self.assertIs(sections, context.sections)
+        frames.close()
+        self.assertIsNone(context.prewarm)
+
+    def test_follows(self):
+        config = offlineconfig(prewarm = 3)
+        context = Context(config, ())
+        context.update(TestFrames.text + '''
+class Bad:
+    def on(self, frame, chip):
+        raise Exception('bad')
+B = E(Bad, '1'),''')
+        context.flip()
+        recorder = Recorder()
+        frames = LiveCodingBridge(config, context).frames(dict(chip = recorder.proxies('chip', 1)))
+        for _ in islice(frames, 2):
+            recorder.frameindex += 1
+        with self.assertNoLogs('lurlene.util'): # Would be in B if the frame index wasn't remapped.
+            context.update('sections = [B, A]\nspeed = 3')
+        frames.close()
+
+    def test_patternedit(self):
+        config = offlineconfig(lazy = True, prewarm = 3)
+        context = Context(config, ())
+        context.update(TestFrames.text)
+        context.flip()
+        recorder = Recorder()
+        frames = LiveCodingBridge(config, context).frames(dict(chip = recorder.proxies('chip', 1)))
+        for _ in islice(frames, 2):
+            recorder.frameindex += 1
+        with self.assertLogs('lurlene.util') as cm: # Sections is unchanged but what it plays is not.
+            context.update("""class Bad:
+    def on(self, frame, chip):
+        raise Exception('bad')
+A = E(Bad, '1'),""")
+        self.assertEqual(['ERROR:lurlene.util:Channel A update failed:'], [line.split('\n')[0] for line in cm.output])
+        frames.close()
+
+    def test_beforeflip(self):
+        context = Context(offlineconfig(), ())
+        context.update(TestFrames.text)
+        context.flip()
+        speeds = []
+        def prewarm(view):
+            flip = threading.Thread(target = context.flip) # Like the frame thread.
+            flip.start()
+            flip.join()
+            speeds.append(context.get('speed'))
+        context.prewarm = prewarm
+        context.update('speed = 3')
+        self.assertEqual([2], speeds)
+        context.flip()
+        self.assertEqual(3, context.get('speed'))
+        with self.assertNoLogs('lurlene.context', 'ERROR'):
+            context.update('sections = []')
+        self.assertEqual([2], speeds)
+
+class TestTabulator(TestCase):
+
+    def test_works(self):
+        v = V('1 2 3')
+        for _ in range(tabulation.warmup):
+            self.assertIsNone(tabulation.get(v, 4, .5))
+        tabulator = Tabulator()
+        tabulator.start()
+        try:
+            deadline = time.time() + 5
+            while tabulation.get(v, 4, .5) is None and time.time() < deadline:
+                time.sleep(.001)
+        finally:
+            tabulator.stop()
+        self.assertEqual(12, len(tabulation.get(v, 4, .5).values))
+
+class TestDefaults(TestCase):
+
+    def _bridge(self, **lurlene):
+        config = SimpleNamespace(tuning = None, ignoreloop = False, section = None, Lurlene = SimpleNamespace(lazy = False, **lurlene)) # Like a host config predating the optional settings.
+        return LiveCodingBridge(config, Context(config, ()))
+
+    def test_deadline(self):
+        self.assertIsNone(self._bridge().timings.deadline)
+
+    def test_prewarm(self):
+        self.assertEqual(0, self._bridge(deadline = None).prewarm)
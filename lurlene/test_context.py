@@ -15,7 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with Lurlene.  If not, see <http://www.gnu.org/licenses/>.
 
-from .context import Context
+from .context import Context, FrameView
 from types import SimpleNamespace
 from unittest import TestCase
 
@@ -67,3 +67,132 @@ sections = [x, y]''')
         self.assertIs(s, self.c.get('sections'))
         self.c.flip()
         self.assertEqual([self.c.get('y'), self.c.get('z')], self.c.get('sections'))
+
+    def test_resend(self):
+        text = '''from lurlene import V
+x = V('1 2')
+y = x + V('1')'''
+        self.c.update(text)
+        self.c.flip()
+        generation = self.c.generation
+        x, y = self.c.get('x'), self.c.get('y')
+        self.c.update(text)
+        self.c.flip()
+        self.assertEqual(generation, self.c.generation)
+        self.assertIs(x, self.c.get('x'))
+        self.c.update(text.replace('2', '3'))
+        self.c.flip()
+        self.assertEqual(generation + 1, self.c.generation)
+        self.assertIsNot(x, self.c.get('x'))
+        self.assertIsNot(y, self.c.get('y'))
+
+    def test_lazyversion(self):
+        c = Context(SimpleNamespace(tuning = None, Lurlene = SimpleNamespace(lazy = True)), ())
+        c.update('x = 1\ny = [x]')
+        c.flip()
+        self.assertEqual(1, c.get('y')[0] + 0)
+        c.update('x = 2')
+        self.assertEqual(2, c.get('y')[0] + 0)
+
+    def test_resize(self):
+        c = Context(SimpleNamespace(tuning = None, Lurlene = SimpleNamespace(lazy = True)), ())
+        c.update('''from lurlene.api import E
+from lurlene.xtra import XTRA
+A = E(XTRA, '1')
+B = E(XTRA, '2')
+C = E(XTRA, '3')
+speed = 2
+sections = (A, B), (C,), (A,)''')
+        c.flip()
+        sections = c.sections
+        self.assertEqual([4, 10, 12], sections.sectionends)
+        c.update("A = E(XTRA, '4')")
+        c.flip()
+        self.assertIs(sections, c.sections)
+        self.assertEqual([8, 14, 22], sections.sectionends)
+        self.assertEqual(22, sections.totalframecount)
+        c.update("C = E(XTRA, '1')")
+        c.flip()
+        self.assertEqual([8, 10, 18], sections.sectionends)
+        self.assertEqual((sections.sections[2], 3), sections.sectionandframe(13))
+        c.update('del A')
+        c.flip()
+        with self.assertLogs('lurlene.util'):
+            self.assertEqual([8, 10, 18], sections.sectionends)
+
+    def test_resizenested(self):
+        c = Context(SimpleNamespace(tuning = None, Lurlene = SimpleNamespace(lazy = True)), ())
+        c.update('''from lurlene.api import E, V
+from lurlene.xtra import XTRA
+A = E(XTRA, '1')
+B = E(XTRA, '1')
+X = V('1')
+Y = V('2')
+speed = 1
+S = A | B,
+T = X + Y,
+sections = [S, T]''')
+        c.flip()
+        sections = c.sections
+        self.assertEqual([2, 3], sections.sectionends)
+        c.update("B = E(XTRA, '8')")
+        c.flip()
+        self.assertEqual([9, 10], sections.sectionends)
+        c.update("Y = V('1 2 3')")
+        c.flip()
+        self.assertEqual([9, 12], sections.sectionends)
+
+    def test_failedupdate(self):
+        self.c.update('speed = 4')
+        self.c.flip()
+        generation = self.c.generation
+        with self.assertRaises(NameError):
+            self.c.update('speed = 8\nundefined_name')
+        self.c.flip()
+        self.assertEqual(4, self.c.get('speed'))
+        self.assertEqual(generation, self.c.generation)
+
+    def test_newname(self):
+        self.c.update('''x = 1''')
+        with self.assertRaises(Context.NoSuchGlobalException) as cm:
+            self.c.get('x')
+        self.assertEqual(('x',), cm.exception.args)
+        self.c.flip()
+        self.assertEqual(1, self.c.get('x'))
+
+    def test_snapshot(self):
+        self.c.update('''x = 1
+y = 2''')
+        self.c.flip()
+        self.assertEqual({}, self.c.view.snapshot)
+        self.c.update('''x = 3''')
+        self.c.update('''x = 4
+del y''')
+        self.assertEqual(dict(x = 1, y = 2), self.c.view.snapshot)
+        self.assertEqual(1, self.c.get('x'))
+        self.assertEqual(2, self.c.get('y'))
+        self.c.flip()
+        self.assertEqual({}, self.c.view.snapshot)
+        self.assertEqual(4, self.c.get('x'))
+
+class TestFrameView(TestCase):
+
+    tuning = None
+    Lurlene = SimpleNamespace(lazy = False)
+
+    def test_works(self):
+        c = Context(self, ())
+        c.update('''tonic = 60
+speed = 4''')
+        c.flip()
+        v = FrameView(c)
+        self.assertEqual(4, v.speed)
+        self.assertEqual(60, v.tonic)
+        self.assertEqual(1, v.mode)
+        self.assertEqual((), v.sections.sections)
+        c.update('''speed = 5''')
+        c.flip()
+        self.assertEqual(4, v.speed)
+        with self.assertRaises(Context.NoSuchGlobalException) as cm:
+            v.scale
+        self.assertEqual(('scale',), cm.exception.args)
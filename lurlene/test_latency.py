@@ -0,0 +1,64 @@
+# Copyright 2019 Andrzej Cichocki
+
+# This file is part of Lurlene.
+#
+# Lurlene is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Lurlene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Lurlene.  If not, see <http://www.gnu.org/licenses/>.
+
+from .latency import Histogram, Timings
+from unittest import TestCase
+
+class TestHistogram(TestCase):
+
+    def test_exact(self):
+        h = Histogram()
+        for v in range(1, 101):
+            h.record(v)
+        self.assertEqual(100, h.count)
+        self.assertEqual(50, h.percentile(50))
+        self.assertEqual(99, h.percentile(99))
+        self.assertEqual(100, h.percentile(100))
+        self.assertEqual(10, h.above(90))
+
+    def test_precision(self):
+        h = Histogram()
+        for v in 1000, 10 ** 6, 10 ** 9:
+            h.record(v)
+        for p, v in (33, 1000), (66, 10 ** 6), (90, 10 ** 9):
+            self.assertGreaterEqual(h.percentile(p), v)
+            self.assertLess(h.percentile(p), v * (1 + 2 ** -6))
+        self.assertEqual(10 ** 9, h.percentile(100))
+
+    def test_empty(self):
+        self.assertEqual(None, Histogram().percentile(50))
+
+class TestTimings(TestCase):
+
+    def test_misses(self):
+        t = Timings(.001)
+        for elapsed in 10 ** 5, 10 ** 6, 10 ** 6 + 1, 10 ** 7:
+            t.framedone(elapsed)
+        self.assertEqual(2, t.misses)
+        t.channel('A').record(5)
+        s = t.summary()
+        self.assertEqual(4, s['frame']['count'])
+        self.assertEqual(.01, s['frame']['max'])
+        self.assertEqual(['A'], list(s['channels']))
+        self.assertEqual(None, s['flip']['p99'])
+        a = t.channel('A')
+        t.reset()
+        self.assertEqual(0, t.misses)
+        self.assertEqual(0, t.summary()['frame']['count'])
+        self.assertEqual(0, t.summary()['channels']['A']['count'])
+        a.record(7)
+        self.assertEqual(1, t.summary()['channels']['A']['count'])
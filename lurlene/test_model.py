@@ -15,9 +15,12 @@
 # You should have received a copy of the GNU General Public License
 # along with Lurlene.  If not, see <http://www.gnu.org/licenses/>.
 
-from .api import E, V
-from .model import Event
+from .api import D, E, V
+from .model import Event, Tabulation
+from .util import Lazy
+from fractions import Fraction
 from unittest import TestCase
+import copy, numpy as np
 
 class TestEvent(TestCase):
 
@@ -111,3 +114,135 @@ class TestSlice(TestCase):
         p.apply(1, 4.5, {})
         p.apply(1, 5.5, {})
         self.assertEqual([4.5, 8.5, 9], vals)
+
+class TestGetBlock(TestCase):
+
+    frames = np.arange(-50, 400) / 4 + .1
+
+    def _check(self, p):
+        expected = np.array([p[f] for f in self.frames])
+        actual = p.getblock(self.frames)
+        self.assertEqual(expected.shape, actual.shape)
+        self.assertTrue(np.allclose(expected, actual))
+
+    def test_v(self):
+        self._check(V('1 2 3/1', step = 5))
+        self._check(V('12x13// 10/'))
+        self._check(V('1 2,3 4/1'))
+
+    def test_scalars(self):
+        self.assertFalse(D('1 2')[.5].flags.writeable) # Flat segments return their initial directly.
+
+    def test_d(self):
+        self._check(D('1 2 3 + 2+ - 2- ++ -- 2++ 2-- 3#+ 4bb-'))
+        self._check(D('-') + D('- 5- 1 5,+').of(6))
+
+    def test_operators(self):
+        self._check((V('12x13// 10/') + V('4x5/ 9')).of(6) >> 3)
+        self._check(V('100x/ 100')[95:] - V('3') * V('2 5'))
+        self._check(V('4x5/ 9')[-1:11])
+        self._check((V('1 2') | V('3') | V('.5x7')).of(3) << 2)
+
+    def test_events(self):
+        e = E(None, '4x1 3r1 1') | E(None, '2.5')
+        events = e.getblock(self.frames)
+        self.assertEqual([e[f].absframe for f in self.frames], [x.absframe for x in events])
+        self.assertEqual([e[f].onframes for f in self.frames], [x.onframes for x in events])
+
+    def test_merge(self):
+        e = E(None, '1 2') & E(None, '3')
+        overlays = e.getblock(self.frames)
+        for part in 'e1', 'e2':
+            self.assertEqual([getattr(e[f], part).absframe for f in self.frames], [getattr(x, part).absframe for x in overlays])
+
+class TestCursor(TestCase):
+
+    def test_matchesbisect(self):
+        v = V(' '.join(f"{i % 7}x{i % 3}/" for i in range(100)), step = 2)
+        c = v.cursor()
+        frames = [f / 4 for f in range(1000)] + [250, 3.5, -10.25, 400, 399.5] + [f / 3 for f in range(200, 300)]
+        self.assertEqual([v[f] for f in frames], [c[f] for f in frames])
+
+    def test_index(self):
+        c = V('1 2 3 4').segments.cursor()
+        self.assertEqual(4, c.forframe(3.5, 0))
+        self.assertEqual(3, c.index)
+        self.assertEqual(1, c.forframe(4, 0))
+        self.assertEqual(0, c.index)
+        self.assertEqual(3, c.forframe(6.5, 0))
+        self.assertEqual(2, c.index)
+
+    def test_delegates(self):
+        d = D('1 3 5')
+        expected = [inv[f].tolist() for inv in d.inversions() for f in range(3)]
+        self.assertEqual(expected, [inv[f].tolist() for inv in d.cursor().inversions() for f in range(3)])
+        c = d.segments.cursor()
+        self.assertIs(d.segments.kinds, c.kinds)
+        copy.copy(c)
+
+class TestTabulation(TestCase):
+
+    def test_period(self):
+        self.assertEqual(3, V('1 2 3').period)
+        self.assertEqual(None, V('1 2 3', step = 1).period)
+        self.assertEqual(6, (V('1 2') + V('1 2 3')).period)
+        self.assertEqual(Fraction(9, 2), (V('.5x1 2') * V('.5x1 1')).of(3).period)
+        self.assertEqual(5, (V('1 2') | V('1 2 3')).period)
+        self.assertEqual(None, ((V('1 2') + V('1 2 3')) | V('1')).period)
+        self.assertEqual(None, V('1 2,3').period)
+        self.assertEqual(4, V('1 2')[:4].period)
+
+    def test_lazyoperand(self):
+        g = dict(n = 1)
+        v = V('1 2 3') >> Lazy(g, 'n')
+        self.assertEqual(None, v.period)
+        self.assertEqual(None, V('1 2 3').of(Lazy(g, 'n')).period)
+        t = Tabulation(1 << 20)
+        t.warmup = 1
+        t.get(v, 1, 0)
+        t.build()
+        self.assertIs(None, t.get(v, 1, 0)) # Would be stale once n is rebound.
+        self.assertEqual(3, v[0])
+        g['n'] = 2
+        self.assertEqual(2, v[0])
+
+    def test_values(self):
+        v = V('8x15/ 3 2x7//') + V('1 2 3')
+        t = Tabulation(1 << 20)
+        for _ in range(t.warmup):
+            self.assertIs(None, t.get(v, 4, .5))
+        self.assertIs(None, t.get(v, 4, .5)) # Requested but not built yet.
+        self.assertTrue(t.build())
+        self.assertFalse(t.build())
+        table = t.get(v, 4, .5)
+        self.assertEqual(132, len(table.values))
+        for f in range(-100, 500):
+            self.assertAlmostEqual(v.of(4)[f + .5], table[f + .5])
+
+    def test_events(self):
+        e = E(None, '2 2r1 z 1/3') >> 1
+        t = Tabulation(1 << 20)
+        t.warmup = 1
+        t.get(e, 3, .5)
+        t.build()
+        table = t.get(e, 3, .5)
+        for f in range(-100, 500):
+            self.assertAlmostEqual(e.of(3)[f + .5].absframe, table[f + .5].absframe)
+            self.assertEqual(e.of(3)[f + .5].onframes, table[f + .5].onframes)
+
+    def test_evict(self):
+        t = Tabulation(1 << 20)
+        t.warmup = 1
+        v, w = V('1 2'), V('3 4')
+        def get(*key):
+            t.get(*key)
+            while t.build():
+                pass
+            return t.get(*key)
+        get(v, 16, .5)
+        get(w, 16, .5)
+        t.budget = t.size
+        get(v, 16, .5) # Now most recently used.
+        get(v, 8, .5)
+        self.assertEqual([(v, 16, .5), (v, 8, .5)], list(t.tables))
+        self.assertLessEqual(t.size, t.budget)
@@ -0,0 +1,93 @@
+# Copyright 2019 Andrzej Cichocki
+
+# This file is part of Lurlene.
+#
+# Lurlene is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Lurlene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Lurlene.  If not, see <http://www.gnu.org/licenses/>.
+
+from .bridge import LiveCodingBridge
+from .context import Context
+from .model import tabulation
+from .offline import _slices, loopframecount, offlineconfig, Recorder, render, renderparallel
+from itertools import islice
+from unittest import TestCase
+
+class TestRender(TestCase):
+
+    text = '''from lurlene import E, V
+class N:
+    def on(self, frame, chip, pitch):
+        chip.pitch = pitch[frame]
+A = E(N, '2 1', pitch = V('1 2 3')),
+B = E(N, '1', pitch = V('4')),
+speed = 2
+sections = [A, B]'''
+
+    def setUp(self):
+        self.config = offlineconfig()
+        self.context = Context(self.config, ())
+        self.context.update(self.text)
+        self.context.flip()
+
+    def _render(self, framecount = None):
+        recorder = Recorder()
+        bridge = LiveCodingBridge(self.config, self.context)
+        return render(bridge, dict(chip = recorder.proxies('chip', 1)), recorder, framecount)
+
+    def test_loops(self):
+        self.assertEqual(8, loopframecount(LiveCodingBridge(self.config, self.context)))
+        writes = self._render(16)
+        self.assertEqual(list(range(16)), [w[0] for w in writes])
+        self.assertEqual([1, 1, 2, 2, 3, 3, 4, 4] * 2, [w[4] for w in writes])
+        self.assertEqual({('chip', 0, 'pitch')}, {w[1:4] for w in writes})
+
+    def test_section(self):
+        self.config.ignoreloop = True
+        self.config.section = 'B'
+        self.assertEqual([(0, 'chip', 0, 'pitch', 4), (1, 'chip', 0, 'pitch', 4)], self._render())
+
+    def test_tabulated(self):
+        self.context.update('''from lurlene import E, V
+class N:
+    def on(self, frame, chip, pitch):
+        chip.pitch = pitch[frame]
+A = E(N, '2 1', pitch = V('0/3 1.1/5 2.7')),
+B = E(N, '3', pitch = V('4/7 .3')),
+speed = 3
+sections = [A, B]''') # Table arithmetic differs slightly from direct evaluation here.
+        self.context.flip()
+        expected = self._render(64)
+        recorder = Recorder()
+        for _ in islice(LiveCodingBridge(self.config, self.context).frames(dict(chip = recorder.proxies('chip', 1))), 64 * tabulation.warmup):
+            pass
+        while tabulation.build():
+            pass
+        self.assertTrue(tabulation.tables)
+        self.assertEqual(expected, self._render(64))
+
+    def test_needsframecount(self):
+        with self.assertRaises(ValueError):
+            self._render()
+
+    def test_parallel(self):
+        expected = self._render(20)
+        self.assertEqual(expected, renderparallel(self.config, self.text, dict(chip = 1), 20, workers = 2))
+        self.assertEqual(expected, renderparallel(self.config, self.text, dict(chip = 1), 20, 3, 2))
+        self.config.ignoreloop = True
+        self.assertEqual(self._render(), renderparallel(self.config, self.text, dict(chip = 1), workers = 2))
+
+    def test_slices(self):
+        sections = self.context.sections # Ends at 6 and 8.
+        self.assertEqual([(0, 6), (6, 2), (8, 6), (14, 2), (16, 4)], _slices(sections, 0, 20, .5, None))
+        self.assertEqual([(0, 2), (2, 6), (8, 1)], _slices(sections, 6, 9, .5, None))
+        self.assertEqual([(0, 3), (3, 3), (6, 1)], _slices(sections, 6, 7, .5, 3))
@@ -0,0 +1,186 @@
+# Copyright 2019 Andrzej Cichocki
+
+# This file is part of Lurlene.
+#
+# Lurlene is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Lurlene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Lurlene.  If not, see <http://www.gnu.org/licenses/>.
+
+from .osc import AsyncOSCServer, Handler, LurleneHandler, OSCClient, OSCListen, UpdateQueue
+from types import SimpleNamespace
+from unittest import TestCase
+import socket, threading, time, timelyOSC
+
+class Recorder(Handler):
+
+    addresses = '/a', '/b'
+
+    def __init__(self):
+        self.messages = []
+
+    def handle(self, timetags, message, reply):
+        self.messages.append((message.addrpattern, message.args))
+
+class TestOSCClient(TestCase):
+
+    def setUp(self):
+        self.recorder = Recorder()
+        self.client = OSCClient('127.0.0.1', 0, 64, {a: self.recorder for a in self.recorder.addresses})
+        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def tearDown(self):
+        self.sender.close()
+        self.client.sock.close()
+
+    def _send(self, *datagrams):
+        for datagram in datagrams:
+            self.sender.sendto(datagram, self.client.sock.getsockname())
+
+    def test_batch(self):
+        self._send(*(timelyOSC.Message(('/a', '/b')[i % 2], [str(i)]).ser() for i in range(5)))
+        self.client.pumponeortimeout()
+        self.assertEqual([(('/a', '/b')[i % 2], [str(i)]) for i in range(5)], self.recorder.messages)
+        self.assertEqual(5, self.client.received)
+
+    def test_oversized(self):
+        self._send(timelyOSC.Message('/a', ['x' * 100]).ser(), b'garbage', timelyOSC.Message('/b', ['y']).ser())
+        self.client.pumponeortimeout()
+        self.assertEqual([('/b', ['y'])], self.recorder.messages)
+        self.assertEqual((3, 1, 2), (self.client.received, self.client.oversized, self.client.dropped))
+
+class Replier(Handler):
+
+    addresses = '/reply',
+
+    def __init__(self):
+        self.threads = []
+
+    def handle(self, timetags, message, reply):
+        self.threads.append(threading.current_thread())
+        reply(timelyOSC.Message('/done', message.args).ser())
+
+class TestAsyncOSCServer(TestCase):
+
+    def test_works(self):
+        recorder, replier = Recorder(), Replier()
+        server = AsyncOSCServer([('127.0.0.1', 0), ('127.0.0.1', 0)], 64, {a: h for h in [recorder, replier] for a in h.addresses})
+        thread = threading.Thread(target = server.run)
+        thread.start()
+        try:
+            self.assertTrue(server.ready.wait(5))
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                sock.settimeout(5)
+                first, second = (p.transport.get_extra_info('sockname') for p in server.protocols)
+                sock.sendto(timelyOSC.Message('/a', ['x' * 100]).ser(), first)
+                sock.sendto(timelyOSC.Message('/b', ['y']).ser(), first)
+                sock.sendto(timelyOSC.Message('/reply', ['z']).ser(), first)
+                sock.sendto(timelyOSC.Message('/reply', ['zz']).ser(), second)
+                replies = [timelyOSC.parse(sock.recv(64)) for _ in range(2)]
+            self.assertEqual({('/done', 'z'), ('/done', 'zz')}, {(reply.addrpattern, *reply.args) for reply in replies})
+            self.assertEqual([('/b', ['y'])], recorder.messages)
+            self.assertEqual((3, 1, 1), tuple(getattr(server.protocols[0], name) for name in ['received', 'oversized', 'dropped']))
+            self.assertEqual([thread, thread], replier.threads) # On the loop.
+        finally:
+            server.interrupt()
+            thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+class TestUpdateQueue(TestCase):
+
+    def update(self, text):
+        self.started.set()
+        self.release.wait(5)
+        self.texts.append(text)
+
+    def setUp(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.texts = []
+
+    def test_coalesce(self):
+        q = UpdateQueue(self, 0)
+        q.start()
+        self.addCleanup(q.stop)
+        q.put('a')
+        self.assertTrue(self.started.wait(5))
+        for text in 'bcd':
+            q.put(text)
+        self.release.set()
+        with q.cond:
+            self.assertTrue(q.cond.wait_for(lambda: 2 == q.applied, 5))
+        self.assertEqual(['a', 'd'], self.texts)
+        self.assertEqual((4, 2, 2), (q.received, q.coalesced, q.applied))
+
+    def test_debounce(self):
+        self.release.set()
+        q = UpdateQueue(self, .2)
+        q.start()
+        self.addCleanup(q.stop)
+        for text in 'abc':
+            q.put(text)
+        with q.cond:
+            self.assertTrue(q.cond.wait_for(lambda: q.applied, 5))
+        self.assertEqual(['c'], self.texts)
+        self.assertEqual((3, 2, 1), (q.received, q.coalesced, q.applied))
+
+    def test_stop(self):
+        q = UpdateQueue(self, 0)
+        q.start()
+        q.put('a')
+        self.assertTrue(self.started.wait(5))
+        q.put('b')
+        stopper = threading.Thread(target = q.stop)
+        stopper.start()
+        stopper.join(.1)
+        self.assertTrue(stopper.is_alive()) # Waiting for the update in progress.
+        self.release.set()
+        stopper.join(5)
+        self.assertFalse(q.thread.is_alive())
+        self.assertEqual(['a'], self.texts) # Not applied once stopped.
+
+class TestLurleneHandler(TestCase):
+
+    def test_defaults(self):
+        handler = LurleneHandler(SimpleNamespace(Lurlene = SimpleNamespace(lazy = False)), None) # No debounce setting.
+        self.assertEqual(0, handler.queue.debounce)
+
+class TestOSCListen(TestCase):
+
+    def test_handlerlifecycle(self):
+        class Lifecycle(Recorder):
+            def start(self):
+                events.append('start')
+            def stop(self):
+                events.append('stop')
+        events = []
+        listen = OSCListen(SimpleNamespace(profile = None, OSC = SimpleNamespace(host = '127.0.0.1', port = 0, bufsize = 64, asyncio = True)), [Lifecycle()])
+        listen.start()
+        self.assertEqual(['start'], events) # Once despite serving two addresses.
+        listen.stop()
+        self.assertEqual(['start', 'stop'], events)
+
+    def test_threaded(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        recorder = Recorder()
+        listen = OSCListen(SimpleNamespace(profile = None, OSC = SimpleNamespace(host = '127.0.0.1', port = port, bufsize = 64)), [recorder]) # No asyncio setting.
+        listen.start()
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                sock.sendto(timelyOSC.Message('/a', ['x']).ser(), ('127.0.0.1', port))
+            deadline = time.time() + 5
+            while not recorder.messages and time.time() < deadline:
+                time.sleep(.001)
+        finally:
+            listen.stop()
+        self.assertEqual([('/a', ['x'])], recorder.messages)
@@ -15,7 +15,9 @@
 # You should have received a copy of the GNU General Public License
 # along with Lurlene.  If not, see <http://www.gnu.org/licenses/>.
 
-from .parse import VParse, EParse, BadWordException, _flatten, _readnumber
+from .api import E, V
+from .model import Segments
+from .parse import VParse, EParse, BadWordException, _flatten, _readnumber, silence
 from .util import Lazy
 from unittest import TestCase
 
@@ -23,27 +25,27 @@ class TestVParse(TestCase):
 
     @staticmethod
     def _perframes(segments):
-        return [getattr(s, 'perframe', None) for s in segments.segments]
+        return [None if Segments.flat == k else p for k, p in zip(segments.kinds, segments.perframes)]
 
     def test_works(self):
         segments = VParse(float, 0, False).parse('1/1 2/1 .5/1', None)
-        self.assertEqual([0, 1, 2], segments.frames)
+        self.assertEqual([0, 1, 2], list(segments.frames))
         self.assertEqual(3, segments.len)
-        self.assertEqual([1, 2, .5], [s.initial for s in segments.segments])
+        self.assertEqual([1, 2, .5], list(segments.initials))
         self.assertEqual([1, -1.5, .5], self._perframes(segments))
 
     def test_widths(self):
         segments = VParse(float, 0, False).parse('1x/1 2x1/1 .5x2/.5', None) # Default value is 0.
-        self.assertEqual([0, 1, 2, 3], segments.frames)
+        self.assertEqual([0, 1, 2, 3], list(segments.frames))
         self.assertEqual(3.5, segments.len)
-        self.assertEqual([0, 1, 1, 2], [s.initial for s in segments.segments])
+        self.assertEqual([0, 1, 1, 2], list(segments.initials))
         self.assertEqual([1, None, 1, -4], self._perframes(segments))
 
     def test_slides(self):
         segments = VParse(float, 0, False).parse('5/.5 4/1 2x3/ 2/1', None) # Width of first word still implicitly 1.
-        self.assertEqual([0, .5, 1, 2, 4], segments.frames)
+        self.assertEqual([0, .5, 1, 2, 4], list(segments.frames))
         self.assertEqual(5, segments.len)
-        self.assertEqual([5, 5, 4, 3, 2], [s.initial for s in segments.segments])
+        self.assertEqual([5, 5, 4, 3, 2], list(segments.initials))
         self.assertEqual([None, -2, -1, -.5, 3], self._perframes(segments))
 
     def test_x(self):
@@ -53,39 +55,46 @@ class TestVParse(TestCase):
 
     def test_slash(self):
         segments = VParse(float, 0, False).parse('/ 7', None)
-        self.assertEqual([0, 1], segments.frames)
+        self.assertEqual([0, 1], list(segments.frames))
         self.assertEqual(2, segments.len)
-        self.assertEqual([0, 7], [s.initial for s in segments.segments])
+        self.assertEqual([0, 7], list(segments.initials))
         self.assertEqual([7, None], self._perframes(segments))
 
     def test_combo(self):
         segments = VParse(float, 0, False).parse('5x4/10 0/1', None)
-        self.assertEqual([0, 5], segments.frames)
+        self.assertEqual([0, 5], list(segments.frames))
         self.assertEqual(6, segments.len)
-        self.assertEqual([4, 0], [s.initial for s in segments.segments])
+        self.assertEqual([4, 0], list(segments.initials))
         self.assertEqual([-.4, 4], self._perframes(segments))
 
     def test_excess(self):
         segments = VParse(float, 0, False).parse('5/ 6/2 7', None)
-        self.assertEqual([0, 1, 2], segments.frames)
+        self.assertEqual([0, 1, 2], list(segments.frames))
         self.assertEqual(3, segments.len)
-        self.assertEqual([5, 6, 7], [s.initial for s in segments.segments])
+        self.assertEqual([5, 6, 7], list(segments.initials))
         self.assertEqual([1, .5, None], self._perframes(segments))
 
     def test_excess2(self):
         segments = VParse(float, 0, False).parse('5/2 6/', None)
-        self.assertEqual([0, 1], segments.frames)
+        self.assertEqual([0, 1], list(segments.frames))
         self.assertEqual(2, segments.len)
-        self.assertEqual([5, 6], [s.initial for s in segments.segments])
+        self.assertEqual([5, 6], list(segments.initials))
         self.assertEqual([.5, -1], self._perframes(segments))
 
     def test_halfnotes(self):
         segments = VParse(float, 0, False).parse('2.5x4/1 0/1', None) # Implicit slide is still 1.
-        self.assertEqual([0, 1.5, 2.5], segments.frames)
+        self.assertEqual([0, 1.5, 2.5], list(segments.frames))
         self.assertEqual(3.5, segments.len)
-        self.assertEqual([4, 4, 0], [s.initial for s in segments.segments])
+        self.assertEqual([4, 4, 0], list(segments.initials))
         self.assertEqual([None, -4, 4], self._perframes(segments))
 
+    def test_bias(self):
+        segments = VParse(float, 0, False).parse('2x5// 4// 3', None)
+        self.assertEqual([Segments.biased, Segments.biased, Segments.flat], list(segments.kinds))
+        self.assertEqual([.5, .5, 0], list(segments.biases))
+        with self.assertRaises(ValueError):
+            segments.initials[0] = 100
+
 class TestEParse(TestCase):
 
     def test_works(self):
@@ -150,6 +159,25 @@ class TestEParse(TestCase):
         self.assertEqual([0, 2, 2.5], [s.relframe for s in segments.segments])
         self.assertEqual([None, None, None], [s.onframes for s in segments.segments])
 
+class TestParseCache(TestCase):
+
+    def test_shared(self):
+        self.assertIs(VParse(float, 0, False).parse('1 2 3', None), VParse(float, 0, False).parse('1 2 3', None))
+        self.assertIsNot(VParse(float, 0, False).parse('1 2 3', None), VParse(float, 1, False).parse('1 2 3', None))
+        v, w = V('1 2, 3 4'), V('1 2, 3 4')
+        self.assertIs(v.p1.segments, w.p1.segments)
+        self.assertEqual([1, 2, 3, 4], [v[i] for i in range(4)])
+        self.assertEqual(7, V('1 2, 7')[2])
+        self.assertEqual(2.5, V('1 2/, 3 4')[1.5]) # Slides to the successor.
+        self.assertEqual(3.5, V('1 2/, 5 4')[1.5])
+
+    def test_bind(self):
+        e, f = E(int, '1 2z 1r1, 1'), E(float, '1 2z 1r1, 1')
+        for x, cls in (e, int), (f, float):
+            self.assertEqual([cls, silence, cls], [s.program if s.program is silence else s.program.cls for s in x.p1.segments.segments])
+            self.assertEqual({x.p1.segments.segments[0].namespace}, {s.namespace for s in x.p1.segments.segments})
+        self.assertIsNot(e.p1.segments.segments[0].namespace, f.p1.segments.segments[0].namespace)
+
 class TestFlatten(TestCase):
 
     def test_lazy(self):
@@ -0,0 +1,72 @@
+# Copyright 2019 Andrzej Cichocki
+
+# This file is part of Lurlene.
+#
+# Lurlene is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Lurlene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Lurlene.  If not, see <http://www.gnu.org/licenses/>.
+
+from .api import E, V
+from .model import Event, Sum, tabulation
+from .profiler import Profiler
+from unittest import TestCase
+
+class N:
+
+    def on(self, frame, chip, pitch):
+        chip.pitch = pitch[frame]
+
+class Chip: pass
+
+class TestProfiler(TestCase):
+
+    def test_tree(self):
+        pitch = V('1 2') + V('10')
+        namespace = dict(A = (E(N, '1', pitch = pitch),), pitch = pitch, unused = V('1'), N = N)
+        with Profiler() as p:
+            for frame in range(3):
+                namespace['A'][0].apply(1, frame, dict(chip = Chip()))
+        tree = p.tree(namespace)
+        self.assertEqual({'A', 'pitch'}, set(tree))
+        script, = tree['A'].children
+        self.assertEqual(3, script.calls)
+        perform, kwarg = script.children
+        self.assertEqual('perform N', perform.label)
+        self.assertEqual(3, perform.calls)
+        self.assertEqual('pitch Sum', kwarg.label)
+        self.assertEqual(3, kwarg.calls)
+        self.assertEqual(['p1 StepScript', 'p2 StepScript'], [c.label for c in kwarg.children])
+        self.assertEqual([3, 3], [c.calls for c in kwarg.children]) # Not also counted via super.
+        self.assertLessEqual(sum(c.time for c in kwarg.children), kwarg.time)
+        self.assertEqual(6, len(list(tree['A'].lines())))
+
+    def test_tabulated(self):
+        e = E(N, '1', pitch = V('1 2') + V('10'))
+        for _ in range(tabulation.warmup):
+            tabulation.get(e, 1, 0)
+        while tabulation.build():
+            pass
+        self.assertIsNotNone(tabulation.get(e, 1, 0))
+        with Profiler() as p:
+            for frame in range(5):
+                e.apply(1, frame, dict(chip = Chip()))
+        script = p.tree(dict(A = e))['A']
+        self.assertEqual(5, script.calls)
+        self.assertEqual([5, 5], [c.calls for c in script.children[1].children])
+        self.assertIsNotNone(tabulation.get(e, 1, 0))
+
+    def test_restore(self):
+        getitem, perform = Sum.getitem, Event.perform
+        with Profiler():
+            self.assertIsNot(getitem, Sum.getitem)
+        self.assertIs(getitem, Sum.getitem)
+        self.assertIs(perform, Event.perform)
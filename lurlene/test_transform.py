@@ -17,6 +17,7 @@
 
 from .transform import Interpreter
 from unittest import TestCase
+import ast
 
 class TestTransform(TestCase):
 
@@ -34,3 +35,161 @@ xx, yy = 100, 200
 zz = yy''')
         self.assertEqual(dict(snapshot,
                 x = '!a', y = '!b', z = '!y', w = '!x', C = g['C'], ww = '!C', xx = 100, yy = 200, zz = '!yy'), g)
+
+    def test_incremental(self):
+        g = dict(L = lambda _, name: f"!{name}")
+        i = Interpreter('L', g)
+        text = '''import fractions
+a = 1,
+b = a, 2
+class C: pass
+calls = []
+calls.append(b)
+c = b, C'''
+        i.execute(text)
+        first = g.copy()
+        i.execute(text.replace('1,', '3,'))
+        self.assertEqual((3,), g['a'])
+        self.assertIsNot(first['b'], g['b'])
+        self.assertIs(first['C'], g['C'])
+        self.assertIsNot(first['calls'], g['calls']) # Mutable so never reused.
+        self.assertEqual([((3,), 2)], g['calls'])
+        self.assertIsNot(first['c'], g['c'])
+        second = g.copy()
+        g['a'] = None
+        i.execute(text.replace('1,', '3,'))
+        self.assertIs(second['a'], g['a']) # Equivalent to running it again.
+        self.assertIsNot(second['b'], g['b']) # Passed to a method so may have been modified.
+        self.assertIsNot(second['c'], g['c'])
+        self.assertIs(second['C'], g['C'])
+
+    def test_mutatedviaargument(self):
+        g = {}
+        i = Interpreter('L', g)
+        text = 'def add(l, x):\n    l.append(x)\nx = []\nz = add(x, 1)'
+        i.execute(text)
+        i.execute(text.replace('1)', '2)'))
+        self.assertEqual([2], g['x'])
+
+    def test_mutatedbymethod(self):
+        g = {}
+        i = Interpreter('L', g)
+        text = 'hist = ()\nclass N:\n    def on(self, f):\n        global hist\n        hist += f,\nN().on(1)'
+        i.execute(text)
+        self.assertEqual((1,), g['hist'])
+        i.execute(text)
+        self.assertEqual((1,), g['hist'])
+        g.clear()
+        text = 'hist = []\nclass N:\n    def on(self, f):\n        hist.append(f)\nN().on(1)'
+        i.execute(text)
+        i.execute(text)
+        self.assertEqual([1], g['hist'])
+
+    def test_rebindbyfunction(self):
+        g = {}
+        i = Interpreter('L', g)
+        text = 'count = 0\ndef reg():\n    global count\n    count += 1\n    return 5\ndef wrap():\n    return reg()\nx = reg()\ny = wrap()'
+        i.execute(text)
+        self.assertEqual(2, g['count'])
+        i.execute(text)
+        self.assertEqual(2, g['count'])
+        self.assertEqual((5, 5), (g['x'], g['y']))
+
+    def test_readviafunction(self):
+        text = 'def f():\n    return y * 2\ny = 1\nx = f()'
+        for name in 'execute', 'interpret':
+            g = dict(L = lambda g, name: g[name])
+            i = getattr(Interpreter('L', g), name)
+            i(text)
+            i(text) # So that y was already bound when f was defined.
+            i(text.replace('1', '5'))
+            self.assertEqual(10, g['x'])
+
+    def test_readviaattribute(self):
+        text = 'import types\ntypes.FOO = 1\ny = types.FOO * 10'
+        for name in 'execute', 'interpret':
+            g = dict(L = lambda g, name: g[name])
+            i = getattr(Interpreter('L', g), name)
+            i(text)
+            i(text.replace('1\n', '2\n'))
+            self.assertEqual(20, g['y'])
+            del g['types'].FOO
+
+    def test_selfread(self):
+        g = dict(n = 0)
+        i = Interpreter('L', g)
+        i.execute('n = n + 1')
+        i.execute('n = n + 1')
+        self.assertEqual(2, g['n'])
+
+    def test_resendmutated(self):
+        g = {}
+        i = Interpreter('L', g)
+        text = 'x = []\nx.append(1)\ny = [x]\ny[0] = 2'
+        i.execute(text)
+        x, y = g['x'], g['y']
+        i.execute(text)
+        self.assertEqual([1], g['x'])
+        self.assertEqual([2], g['y'])
+        self.assertIsNot(x, g['x'])
+        self.assertIsNot(y, g['y'])
+
+    def test_decoratoredit(self):
+        g = dict(d1 = lambda f: 1, d2 = lambda f: 2)
+        i = Interpreter('L', g)
+        i.execute('@d1\ndef f(): pass')
+        self.assertEqual(1, g['f'])
+        i.execute('@d2\ndef f(): pass')
+        self.assertEqual(2, g['f'])
+
+    def test_incrementallazy(self):
+        g = dict(L = lambda _, name: f"!{name}")
+        i = Interpreter('L', g)
+        i.interpret('x = 1,\ny = x')
+        x, y = g['x'], g['y']
+        self.assertEqual('!x', y)
+        i.interpret('x = 1,\ny = x')
+        self.assertIs(x, g['x'])
+        self.assertIs(y, g['y'])
+
+    def test_decorators(self):
+        text = '''def deco(obj):
+    obj.decorated = True
+    return obj
+x = 1; y = 2
+@deco
+def f(): return 1
+@deco
+@ deco
+class C: pass'''
+        statements = Interpreter('L', {})._split(text)[0]
+        self.assertEqual([(4, 'x = 1'), (4, 'y = 2'), (5, '@deco\ndef f(): return 1'), (7, '@deco\n@ deco\nclass C: pass')], [s[:2] for s in statements[1:]])
+        for _, source, _, statement, *_ in statements:
+            expected, = ast.parse(source).body
+            self.assertEqual(ast.dump(expected, include_attributes = True), ast.dump(statement, include_attributes = True))
+        for name in 'execute', 'interpret':
+            g = dict(L = lambda g, name: g[name])
+            getattr(Interpreter('L', g), name)(text)
+            self.assertTrue(g['f'].decorated)
+            self.assertTrue(g['C'].decorated)
+
+    def test_codecache(self):
+        g = dict(L = lambda _, name: f"!{name}")
+        i = Interpreter('L', g)
+        text = 'x = 1; y = [x]\ndef f():\n    return x / 0'
+        i.execute(text)
+        self.assertEqual((0, 3), (i.codecache.hits, i.codecache.misses))
+        text = '\n\n' + text.replace('1;', '2;')
+        i.execute(text)
+        self.assertEqual((2, 4), (i.codecache.hits, i.codecache.misses))
+        self.assertEqual([2], g['y'])
+        try:
+            g['f']()
+        except ZeroDivisionError as e:
+            self.assertEqual(5, e.__traceback__.tb_next.tb_lineno)
+        else:
+            self.fail()
+        f = g['f']
+        i.execute(text)
+        self.assertEqual((4, 4), (i.codecache.hits, i.codecache.misses)) # As f refers to x, only f is reused.
+        self.assertIs(f, g['f'])
@@ -15,9 +15,12 @@
 # You should have received a copy of the GNU General Public License
 # along with Lurlene.  If not, see <http://www.gnu.org/licenses/>.
 
+from .model import Operators
+from .util import Lazy, LRU
 from collections import defaultdict
 from diapyr.util import innerclass
-import ast, logging
+from types import BuiltinFunctionType, CodeType, FunctionType, ModuleType
+import ast, copy, logging, numbers
 
 log = logging.getLogger(__name__)
 
@@ -29,8 +32,30 @@ class Interpreter:
         def __init__(self):
             self.lazycounts = defaultdict(lambda: 0)
 
+        def generic_visit(self, node): # Copy on write, as the statements are cached.
+            changes = {}
+            for field, old in ast.iter_fields(node):
+                if isinstance(old, list):
+                    new = [self.visit(v) if isinstance(v, ast.AST) else v for v in old]
+                    if any(v is not w for v, w in zip(old, new)):
+                        changes[field] = new
+                elif isinstance(old, ast.AST):
+                    new = self.visit(old)
+                    if new is not old:
+                        changes[field] = new
+            if not changes:
+                return node
+            node = copy.copy(node)
+            for field, new in changes.items():
+                setattr(node, field, new)
+            return node
+
         def visit_ClassDef(self, node):
-            node.body[:] = (self.visit(statement) for statement in node.body)
+            body = [self.visit(statement) for statement in node.body]
+            if all(s is t for s, t in zip(node.body, body)):
+                return node
+            node = copy.copy(node)
+            node.body = body
             return node
 
         def visit_Name(self, node):
@@ -46,15 +71,193 @@ class Interpreter:
             if self.lazycounts:
                 log.debug("Lazy: %s", ', '.join(f"""{n}{f"*{c}" if 1 != c else ''}""" for n, c in self.lazycounts.items()))
 
+    absent = object()
+    bindingtypes = ast.Assign, ast.AnnAssign, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Import, ast.ImportFrom
+    immutabletypes = numbers.Number, str, bytes, type(None), FunctionType, BuiltinFunctionType, type, ModuleType, Operators, Lazy # By convention in the case of patterns.
+    scopetypes = ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda
+
+    class Compiled:
+
+        def __init__(self, source, loadnames, boundnames):
+            self.loadnames = loadnames
+            self.boundnames = None if ':=' in source else boundnames
+            self.codes = {} # Keyed by lazily rewritten names.
+
     def __init__(self, lazyname, globalsdict):
         self.lazyname = lazyname
         self.globalsdict = globalsdict
+        self.memo = {}
+        self.splits = LRU(10)
+        self.codecache = LRU(10000)
 
     def interpret(self, text):
         transform = self.Transform()
-        for statement in ast.parse(text).body:
-            self.justexec(ast.fix_missing_locations(ast.Module([transform.visit(statement)]))) # XXX: Are locations accurate?
+        def tocode(statement, compiled):
+            lazified = frozenset(name for name in compiled.loadnames if name in self.globalsdict)
+            try:
+                return compiled.codes[lazified]
+            except KeyError:
+                pass
+            code = compiled.codes[lazified] = self._compile(ast.fix_missing_locations(ast.Module([transform.visit(statement)], []))) # XXX: Are locations accurate?
+            return code
+        self._incremental(text, tocode)
         transform.report()
 
+    def execute(self, text):
+        'Like justexec but skip unchanged statements.'
+        def tocode(statement, compiled):
+            try:
+                return compiled.codes[None]
+            except KeyError:
+                code = compiled.codes[None] = self._compile(ast.Module([statement], []))
+                return code
+        self._incremental(text, tocode)
+
+    def _split(self, text):
+        'Top-level statements with their line numbers, source, the names they read including via what they call, tree as if parsed from that source, loaded names and bound names, then the names whose objects any statement may modify other than by binding, and the names of functions and classes that may rebind globals.'
+        lines = [f"{line}\n" for line in text.split('\n')] # Same line breaks as the parser.
+        def segment(lineno, statement):
+            first, last = lineno - 1, statement.end_lineno - 1
+            col = statement.col_offset if lineno == statement.lineno else 0 # A top-level decorator can only start its line.
+            if first == last:
+                return _bytes(lines[first])[col:statement.end_col_offset].decode()
+            return ''.join([_bytes(lines[first])[col:].decode(), *lines[first + 1:last], _bytes(lines[last])[:statement.end_col_offset].decode()])
+        mutable = set()
+        impure = set()
+        scans = []
+        scopes = [] # Per statement, the names it binds and the names its nested bodies refer to.
+        for statement in ast.parse(text).body:
+            lineno = min([statement.lineno, *(d.lineno for d in getattr(statement, 'decorator_list', ()))])
+            source = segment(lineno, statement)
+            loads, stores, runloads, scopeloads, globalnames = _scan(statement, lineno)
+            boundnames = _boundnames(statement)
+            if boundnames is None:
+                mutable.update(loads)
+            bound = stores if boundnames is None else boundnames
+            mutable.update(scopeloads) # Anything a body refers to may be modified whenever it runs.
+            if globalnames: # Rebound whenever the body runs, so calling what we bind has side effects.
+                mutable.update(globalnames)
+                impure.update(bound)
+            scans.append((lineno, source, runloads, statement, loads, boundnames))
+            scopes.append((bound, scopeloads))
+        while True: # Likewise anything whose body refers to something impure.
+            more = {name for bound, scopeloads in scopes if not impure.isdisjoint(scopeloads) for name in bound} - impure
+            if not more:
+                break
+            impure.update(more)
+        refers = defaultdict(set)
+        for bound, scopeloads in scopes:
+            for name in bound:
+                refers[name].update(scopeloads)
+        def reads(names): # Calling a function reads whatever its body refers to.
+            names = set(names)
+            pending = list(names)
+            while pending:
+                for name in refers.get(pending.pop(), ()):
+                    if name not in names:
+                        names.add(name)
+                        pending.append(name)
+            return sorted(names)
+        return [(lineno, source, reads(runloads), *rest) for lineno, source, runloads, *rest in scans], mutable, impure
+
+    def _incremental(self, text, tocode):
+        # A statement that only binds immutable objects, and reads the same objects as last time, would bind equivalent objects so reuse them.
+        # Except where any statement may have modified the objects it binds or reads, e.g. by calling a method, or the statement may rebind globals via the global keyword.
+        # Also a function or class that has moved, so that tracebacks have the new line numbers.
+        memo = {}
+        statements, mutable, impure = self.splits.get(text, lambda: self._split(text))
+        for lineno, source, reads, statement, loadnames, boundnames in statements:
+            entry = self.memo.get(source)
+            if entry is not None:
+                oldlineno, oldreads, oldvalues, bound = entry
+                if (oldlineno == lineno or not any(isinstance(v, (FunctionType, type)) for v in bound.values())) and oldreads == reads and mutable.isdisjoint(bound) and mutable.isdisjoint(reads) and impure.isdisjoint(reads) and all(self.globalsdict.get(name, self.absent) is v for name, v in zip(reads, oldvalues)):
+                    self.globalsdict.update(bound)
+                    memo[source] = entry
+                    continue
+            compiled = self.codecache.get(source, lambda: self.Compiled(source, loadnames, boundnames))
+            code = tocode(statement, compiled)
+            values = [self.globalsdict.get(name, self.absent) for name in reads]
+            exec(_relocate(code, lineno - 1), self.globalsdict)
+            if compiled.boundnames is not None:
+                bound = {name: self.globalsdict[name] for name in compiled.boundnames if name in self.globalsdict}
+                if all(map(self._immutable, bound.values())):
+                    memo[source] = lineno, reads, values, bound
+        self.memo = memo
+
+    def _immutable(self, value):
+        if isinstance(value, (tuple, frozenset)):
+            return all(map(self._immutable, value))
+        if isinstance(value, FunctionType):
+            return all(map(self._immutable, [*(value.__defaults__ or ()), *(value.__kwdefaults__ or {}).values()]))
+        return isinstance(value, self.immutabletypes)
+
     def justexec(self, textorast):
-        exec(compile(textorast, '<text>', 'exec'), self.globalsdict)
+        exec(self._compile(textorast), self.globalsdict)
+
+    def _compile(self, textorast):
+        return compile(textorast, '<text>', 'exec')
+
+def _bytes(line):
+    return line.encode() # Column offsets are in UTF-8 bytes.
+
+def _relocate(code, delta):
+    if not delta:
+        return code
+    return code.replace(co_firstlineno = code.co_firstlineno + delta, co_consts = tuple(_relocate(c, delta) if isinstance(c, CodeType) else c for c in code.co_consts))
+
+def _scan(statement, lineno):
+    'Make the locations of the given top-level statement relative to its own source, so that its code can be reused wherever it moves. Return the names it loads, stores, loads when it runs i.e. not in bodies of the functions it defines, loads in bodies of functions and classes, and declares global.'
+    col = statement.col_offset if lineno == statement.lineno else 0
+    loads, stores, runloads, scopeloads, globalnames = set(), set(), set(), set(), set()
+    pending = [(statement, True, False)]
+    while pending:
+        node, running, scoped = pending.pop()
+        if node._attributes:
+            if node.lineno == lineno:
+                node.col_offset -= col
+            if node.end_lineno == lineno:
+                node.end_col_offset -= col
+            node.lineno -= lineno - 1
+            node.end_lineno -= lineno - 1
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                loads.add(node.id)
+                if running:
+                    runloads.add(node.id)
+                if scoped:
+                    scopeloads.add(node.id)
+            elif isinstance(node.ctx, ast.Store):
+                stores.add(node.id)
+            continue
+        if isinstance(node, ast.Global):
+            globalnames.update(node.names)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            stores.add(node.name)
+        body = node.body if isinstance(node, Interpreter.scopetypes) else None
+        for field in node._fields:
+            value = getattr(node, field, None)
+            flags = (running, scoped) if body is None or value is not body else (running and isinstance(node, ast.ClassDef), True) # A class body runs when defined.
+            for child in value if isinstance(value, list) else [value]:
+                if isinstance(child, ast.AST) and not isinstance(child, ast.expr_context):
+                    pending.append((child, *flags))
+    return loads, stores, runloads, scopeloads, globalnames
+
+def _boundnames(statement):
+    'Names bound by the given top-level statement, or None if it may do anything else.'
+    if not isinstance(statement, Interpreter.bindingtypes):
+        return
+    if isinstance(statement, (ast.Import, ast.ImportFrom)):
+        if any('*' == alias.name for alias in statement.names):
+            return
+        return [alias.name.split('.')[0] if alias.asname is None else alias.asname for alias in statement.names]
+    if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return [statement.name]
+    targets = statement.targets if isinstance(statement, ast.Assign) else [statement.target]
+    names = []
+    for target in targets:
+        for node in ast.walk(target):
+            if isinstance(node, ast.Name):
+                names.append(node.id)
+            elif not isinstance(node, (ast.Tuple, ast.List, ast.Starred, ast.expr_context)):
+                return # Attribute or subscript.
+    return names
@@ -15,6 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with Lurlene.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import OrderedDict
 from contextlib import contextmanager
 import threading, logging
 
@@ -50,6 +51,33 @@ def catch(obj, *logargs):
             log.exception(*logargs)
             obj._onfire = True
 
+class LRU:
+
+    def __init__(self, maxsize):
+        self.entries = OrderedDict()
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, factory):
+        'Return the cached value, otherwise call factory outside the lock and cache its result, evicting the least recently used.'
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return value
+        value = factory()
+        with self.lock:
+            self.entries[key] = value
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(False)
+        return value
+
 class All(list):
 
     def __init__(self, namespace):
@@ -60,6 +88,24 @@ class All(list):
             self.namespace[name] = obj
             self.append(name)
 
+def resolve(obj):
+    return obj._resolve() if isinstance(obj, Lazy) else obj
+
+class LazyVersion:
+    'Counts updates to globals that Lazy may resolve against.'
+
+    def __init__(self):
+        self.updates = 0
+
+    @contextmanager
+    def updating(self):
+        try:
+            yield
+        finally:
+            self.updates += 1
+
+lazyversion = LazyVersion()
+
 class Lazy: # XXX: Is this really the most maintainable way?
 
     def __init__(self, globalsdict, name):